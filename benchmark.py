@@ -0,0 +1,234 @@
+"""Measures how fast dictionaries are built and text is checked, using synthetic data. Runs offline."""
+
+import argparse
+import codecs
+import contextlib
+import gzip
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import compiledict
+import dictprocess
+import ingram
+
+
+def make_vocabulary(rng, size):
+    """ Makes up [size] distinct lowercase "words"."""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice("etaoinshrdlucmfwypvbgkjqxz"[:rng.randint(8, 26)]) for i in range(rng.randint(1, 9))))
+    return sorted(words)
+
+
+def make_corpus(config, rng, vocabulary):
+    """ Writes Google ngram v2 style 2-gram files (ngram, year, match count, volume count) for a few prefixes.
+    Returns the source file names and a list of the word pairs that were written."""
+    prefixes = {}
+    for word in vocabulary:
+        if len(word) > 1:
+            prefixes.setdefault(word[0:2], []).append(word)
+    busiest = sorted(prefixes, key=lambda p: len(prefixes[p]), reverse=True)[0:config["sources"]]
+    sources = []
+    pairs = []
+    for prefix in sorted(busiest):
+        lines = []
+        while len(lines) < config["ngrams"]:
+            first = rng.choice(prefixes[prefix])
+            for second in rng.sample(vocabulary, 20):
+                pairs.append(first + " " + second)
+                tag = rng.choice(["", "", "", "_NOUN", "_VERB"])    # Give clean_string some of Google's cruft to remove.
+                for year in sorted(rng.sample(range(1950, 2009), rng.randint(1, 12))):
+                    lines.append("%s%s %s\t%i\t%i\t%i\n" % (first, tag, second, year, rng.randint(1, 400), rng.randint(1, 6)))
+        source_name = config["workpath"] + "googlebooks-eng-us-all-2gram-20120701-" + prefix + ".gz"
+        out_file = gzip.open(source_name, "wb")
+        out_file.write("".join(sorted(lines)).encode('utf-8'))
+        out_file.close()
+        sources.append((source_name, prefix))
+    return sources, pairs
+
+
+def make_document(file_name, rng, vocabulary, pairs, words):
+    """ Writes a text of about [words] words, mostly made of known pairs with some random words and punctuation."""
+    out_file = codecs.open(file_name, 'w', 'utf-8')
+    count = 0
+    line = []
+    while count < words:
+        if rng.random() < 0.7:
+            line.extend(rng.choice(pairs).split(" "))
+            count += 2
+        else:
+            line.append(rng.choice(vocabulary) + rng.choice(["", "", "", ",", ".", " -"]))
+            count += 1
+        if len(line) > 12:
+            out_file.write(" ".join(line) + "\n")
+            line = []
+    out_file.write(" ".join(line) + "\n")
+    out_file.close()
+    return count
+
+
+def bench_process_dict(config, sources, outpath, parsers=0):
+    """ Builds a text dictionary from the synthetic corpus in [outpath], with -parsers [parsers]. Reports input lines per second."""
+    dict_config = dictprocess.get_config(["-inpath", config["workpath"], "-outpath", outpath, "-minfreq", "100", "-startyear", "1950", "-endyear", "2012", "-parsers", str(parsers)])
+    lines = 0
+    start_time = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for source_name, prefix in sources:
+            lines += dictprocess.process_dict(dict_config, source_name, outpath, prefix[0], prefix[1])["in_count"]
+    seconds = time.time() - start_time
+    return {"lines": lines, "seconds": seconds, "lines_per_second": lines / seconds}
+
+
+def bench_file_consolidate(config, rng, vocabulary):
+    """ Consolidates one big file full of duplicates, both in memory and spilling to disk."""
+    results = {}
+    entries = config["ngrams"] * 2
+    for label, run_size in [("in_memory", entries + 1), ("spilled", max(entries // 8, 1))]:
+        file_name = config["workpath"] + "consolidate.txt"
+        out_file = codecs.open(file_name, 'w', 'utf-8')
+        for i in range(entries):
+            out_file.write("%s %s\t%i\n" % (rng.choice(vocabulary[0:200]), rng.choice(vocabulary[0:200]), rng.randint(1, 5000)))
+        out_file.close()
+        start_time = time.time()
+        out_count = dictprocess.file_consolidate(file_name, run_size)
+        seconds = time.time() - start_time
+        results[label] = {"entries": entries, "unique": out_count, "seconds": seconds, "entries_per_second": entries / seconds}
+        os.remove(file_name)
+    return results
+
+
+def checkers(config):
+    """ The dictionary setups worth comparing, as (label, Checker options)."""
+    return [
+        ("text", {"dict": config["dictpath"], "nocompiled": True, "cachemb": 0}),
+        ("text_nofilter", {"dict": config["dictpath"], "nocompiled": True, "nofilter": True, "cachemb": 0}),
+        ("cached", {"dict": config["dictpath"], "nocompiled": True, "cachemb": 64}),
+        ("compiled", {"dict": config["dictpath"]}),
+        ("interned", {"dict": config["internedpath"]}),
+        ("blocks", {"dict": config["blockspath"]}),
+    ]
+
+
+def bench_compile(config):
+    """ Compiles the dictionary each way (the interned and block ones in copies) and builds its Bloom filter.
+    Reports the time taken and the file sizes."""
+    results = {}
+    shutil.copytree(config["dictpath"], config["internedpath"])
+    shutil.copytree(config["dictpath"], config["blockspath"])
+    for label, dictpath, interned, blocks in [("compiled", config["dictpath"], False, False), ("interned", config["internedpath"], True, False), ("blocks", config["blockspath"], False, True)]:
+        start_time = time.time()
+        entries = compiledict.compile_dictionary(dictpath, interned, blocks)
+        seconds = time.time() - start_time
+        results[label] = {"entries": entries, "seconds": seconds, "bytes": os.path.getsize(dictpath + compiledict.COMPILED_NAME)}
+    start_time = time.time()
+    entries = compiledict.build_filter(config["dictpath"])
+    results["filter"] = {"entries": entries, "seconds": time.time() - start_time, "bytes": os.path.getsize(config["dictpath"] + compiledict.FILTER_NAME)}
+    results["text_bytes"] = sum(os.path.getsize(os.path.join(path, name)) for path, folders, names in os.walk(config["dictpath"]) for name in names if name.endswith(".txt"))
+    return results
+
+
+def bench_find_frequency(config, rng, vocabulary):
+    """ Times lookups of pairs that are in the dictionary (hits) and pairs that aren't (misses)."""
+    hits = []
+    for file_name in sorted(os.listdir(config["dictpath"])):
+        if os.path.isdir(config["dictpath"] + file_name):
+            for shard in sorted(os.listdir(config["dictpath"] + file_name)):
+                for ngram, value, decades in dictprocess.read_entries(config["dictpath"] + file_name + "/" + shard):
+                    if " " in ngram:
+                        hits.append(ngram)
+    hits = [rng.choice(hits) for i in range(config["lookups"])]
+    # Misses share a first word with a real entry, so they land in a real dictionary file.
+    misses = [hit.split(" ")[0] + " " + rng.choice(vocabulary) + "qq" for hit in hits]
+
+    results = {}
+    for label, options in checkers(config):
+        checker = ingram.Checker(**options)
+        results[label] = {}
+        for kind, ngrams in [("hit", hits), ("miss", misses)]:
+            start_time = time.time()
+            for ngram in ngrams:
+                checker.frequency(ngram)
+            seconds = time.time() - start_time
+            results[label][kind + "_microseconds"] = seconds / len(ngrams) * 1000000
+        checker.close()
+    return results
+
+
+def bench_process_text(config, document, words):
+    """ Checks the synthetic document end to end, writing csv output to nowhere. Reports words per second."""
+    results = {}
+    setups = checkers(config) + [("compiled_batch", {"dict": config["dictpath"], "batch": 10000})]
+    for label, options in setups:
+        checker = ingram.Checker(**options)
+        text_config = dict(checker.config)
+        text_config.update({"in": document, "out": os.devnull, "type": "csv"})
+        start_time = time.time()
+        with contextlib.redirect_stderr(io.StringIO()):
+            ingram.process_text(text_config, checker)
+        seconds = time.time() - start_time
+        results[label] = {"words": words, "seconds": seconds, "words_per_second": words / seconds}
+        checker.close()
+    return results
+
+
+def run_benchmarks(config):
+    """ Runs everything in a scratch folder. Returns the results."""
+    rng = random.Random(config["seed"])
+    config["workpath"] = tempfile.mkdtemp(prefix="ingram_bench_") + "/"
+    config["dictpath"] = config["workpath"] + "dictionary/"
+    config["internedpath"] = config["workpath"] + "interned/"
+    config["blockspath"] = config["workpath"] + "blocks/"
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+        "parameters": {"seed": config["seed"], "sources": config["sources"], "ngrams": config["ngrams"], "vocabulary": config["vocabulary"], "words": config["words"], "lookups": config["lookups"], "parsers": config["parsers"]},
+    }
+    try:
+        vocabulary = make_vocabulary(rng, config["vocabulary"])
+        sources, pairs = make_corpus(config, rng, vocabulary)
+        document = config["workpath"] + "document.txt"
+        words = make_document(document, rng, vocabulary, pairs, config["words"])
+
+        results["process_dict"] = bench_process_dict(config, sources, config["dictpath"])
+        results["process_dict_pipelined"] = bench_process_dict(config, sources, config["workpath"] + "pipelined/", config["parsers"])
+        results["file_consolidate"] = bench_file_consolidate(config, rng, vocabulary)
+        results["compile"] = bench_compile(config)
+        results["find_frequency"] = bench_find_frequency(config, rng, vocabulary)
+        results["process_text"] = bench_process_text(config, document, words)
+    finally:
+        shutil.rmtree(config["workpath"])
+    return results
+
+
+def get_config():
+    """ Parse the command line arguments. """
+    parser = argparse.ArgumentParser(description="Benchmark ingram's dictionary building and text checking on synthetic data.")
+    parser.add_argument('-out', help='File to save the results (JSON) to. If not defined they are echoed to stdout.', required=False, metavar="FILE")
+    parser.add_argument('-seed', help="Random seed for the synthetic data. (Default: 1)", default=1, type=int, metavar="INT")
+    parser.add_argument('-sources', help="Number of synthetic 2-gram source files. (Default: 2)", default=2, type=int, metavar="INT")
+    parser.add_argument('-ngrams', help="Lines in each synthetic source file. (Default: 100000)", default=100000, type=int, metavar="INT")
+    parser.add_argument('-vocabulary', help="Number of distinct words to make up. (Default: 5000)", default=5000, type=int, metavar="INT")
+    parser.add_argument('-words', help="Words in the synthetic document. (Default: 5000)", default=5000, type=int, metavar="INT")
+    parser.add_argument('-parsers', help="Parser processes for the pipelined process_dict run. (Default: 2)", default=2, type=int, metavar="INT")
+    parser.add_argument('-lookups', help="Lookups timed for each of hits and misses. (Default: 2000)", default=2000, type=int, metavar="INT")
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+    config = get_config()
+    results = run_benchmarks(config)
+    out_string = json.dumps(results, indent=2, sort_keys=True) + "\n"
+    if config["out"] is not None:
+        out_file = codecs.open(config["out"], 'w', 'utf-8')
+        out_file.write(out_string)
+        out_file.close()
+    else:
+        sys.stdout.write(out_string)
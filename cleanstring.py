@@ -1,32 +1,86 @@
+import re
 import unicodedata
+
+
+class _KeepTable(dict):
+	''' A str.translate table that keeps the characters it's built with and drops everything else.
+	Unknown characters are looked up once and remembered.'''
+	def __init__(self, keep, mark=None):
+		dict.__init__(self)
+		for i in keep: self[ord(i)] = ord(i)
+		if mark is not None:
+			for i in "0123456789": self[ord(i)] = ord(mark)
+
+	def __missing__(self, c):
+		self[c] = None
+		return None
+
+
+_letters = "abcdefghijklmnopqrstuvwxyz"
+_string_table = _KeepTable(_letters + " _")
+_chunk_table = _KeepTable(_letters + " _\n", "#")	# Digits become "#" so the lines with them can be thrown out.
+_word_table = _KeepTable(_letters)
+_digits = re.compile("[0-9]")
+#google-added cruft. Removed in this order, since taking one out can leave another behind. (eg: "_end__advx")
+_remove = ["_adj", "_verb", "_noun", "_adj", "_adv", "_pron", "_det", "_adp", "_num", "_conj", "_prt", "_x", "__"] #double underscore at the end is to remove some cruft
+
+
+def _remove_cruft(s):
+	''' Removes the google-added cruft from a string, or a whole chunk of them.'''
+	if "_" in s:
+		for i in _remove: s = s.replace(i, "")
+	return s
+
+
+def has_digits(s):
+	''' True if there's a number anywhere in the string.'''
+	return _digits.search(s) is not None
+
+
+def strip_letters(s):
+	''' Removes everything from the (already lowercase) string that isn't a-z.'''
+	return s.translate(_word_table)
+
+
+def clean_strings(strings):
+	''' Formats a list of ngrams how we like, discarding any info we don't like. Returns a list of the same length.
+	The whole list is normalized in one go, which is much faster per string than calling clean_string.'''
+	strings = [i.decode('utf-8', 'ignore') if isinstance(i, bytes) else i for i in strings]
+	chunk = "\n".join(strings)
+	if chunk.count("\n") != len(strings) - 1:
+		return [clean_string(i) for i in strings]	# Newlines inside an ngram would throw the lines off.
+	#rebuild the strings without numbers or punctuation
+	chunk = unicodedata.normalize("NFKD", chunk).lower()
+	chunk = _remove_cruft(chunk.translate(_chunk_table))
+	cleaned = []
+	for new_string in chunk.split("\n"):
+		if "#" in new_string:
+			new_string = ""	# Don't parse entries with numbers
+		#check to see if it's still 2 (or more) words
+		new_string = new_string.strip(" ")
+		# Sometimes there is only an "_" remaining as a word. Check for it.
+		if new_string.endswith(" _") or new_string.find(" ") == -1:
+			new_string = ""	# If, after all this reduction, it's only one word it's not what we need.
+		cleaned.append(new_string)
+	return cleaned
+
+
 def clean_string(s):
 	''' Formats an ngram how we like, discarding any info we don't like.'''
-	try:
-		s = unicodedata.normalize("NFKD", s.decode('utf-8', 'ignore'))
-	except UnicodeEncodeError:
-		return ""	#some crazy untranslatable unicode got in here, 
-	s = s.lower()
-	#rebuild the string without numbers or punctuation
-	new_string = ""
-	for i in s:
-		skip = False
-		c = ord(i)
-		if c < 97 or c > 122: #Non alpha
-			if c >= 48 and c <= 57: 
-				return ""        # Don't parse entries with numbers
-			if c != 32 and c != 95: skip = True
-		if skip == False: new_string += i
-
-	#remove google-added cruft.
-	remove = ["_adj", "_verb", "_noun", "_adj", "_adv", "_pron", "_det", "_adp", "_num", "_conj", "_prt", "_x", "__"] #double underscore at the end is to remove some cruft
-	for i in remove: new_string= new_string.replace(i,"")
+	if isinstance(s, bytes):
+		s = s.decode('utf-8', 'ignore')
+	s = unicodedata.normalize("NFKD", s).lower()
+	if has_digits(s):
+		return ""        # Don't parse entries with numbers
+	#rebuild the string without numbers or punctuation, and remove google-added cruft.
+	new_string = _remove_cruft(s.translate(_string_table))
 
 	#check to see if it's still 2 (or more) words
-	new_string = new_string.rstrip(" ").lstrip(" ")
+	new_string = new_string.strip(" ")
 	# Sometimes there is only an "_" remaining as a word. Check for it.
 	if new_string.endswith(" _"):
 		new_string = ""
 	if new_string.find(" ") == -1:
 		new_string = ""	# If, after all this reduction, it's only one word it's not what we need.
 
-	return new_string
\ No newline at end of file
+	return new_string
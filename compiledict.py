@@ -0,0 +1,628 @@
+"""Compiles the flat text dictionary shards into a single binary file for fast lookups."""
+
+from array import array
+import argparse
+import bisect
+import codecs
+import hashlib
+import itertools
+import math
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+COMPILED_NAME = "compiled.bin"      # Name of the compiled dictionary inside the dictionary folder.
+FILTER_NAME = "filter.bin"          # Name of the Bloom filter inside the dictionary folder.
+MAGIC = b"INGRAMC1"
+MAGIC_DECADES = b"INGRAMD1"         # Same layout, but every record carries its counts by decade.
+MAGIC_INTERNED = b"INGRAMV1"        # Words stored once, ngrams as pairs of word IDs. See InternedDictionary.
+MAGIC_BLOCKS = b"INGRAMB1"          # Sorted entries in compressed blocks, with an index of the blocks. See BlockDictionary.
+MAGIC_BLOCKS_DECADES = b"INGRAME1"  # Same, with the counts by decade kept in the entries.
+MAGIC_FILTER = b"INGRAMF1"
+CHAR_LIST = "_abcdefghijklmnopqrstuvwxyz"
+FIRST_DECADE = 150                  # Decade numbers are year // 10. Nothing in the corpus is older than the 1500s.
+BLOCK_SIZE = 1024                   # Bytes of entries (before compression) in each block of the block layout.
+
+# File layout (all integers little-endian):
+#   header:     MAGIC, shard count (uint32), letter count (uint32), letters (ascii)
+#   directory:  one entry per shard: name (3 bytes + 1 pad), offset table position (uint64), entries (uint32)
+#   per shard:  entries + 1 absolute record offsets (uint64), then the records themselves,
+#               each one a frequency (uint32) followed by the utf-8 ngram. Records are sorted by ngram.
+#               In MAGIC_DECADES files the frequency is followed by the first decade (uint8, counting from
+#               FIRST_DECADE), the number of decades (uint8) and a count (uint32) for each, then the ngram.
+HEADER = struct.Struct("<8sII")
+DIRECTORY_ENTRY = struct.Struct("<3sxQI")
+OFFSET = struct.Struct("<Q")
+FREQUENCY = struct.Struct("<I")
+DECADE_SPAN = struct.Struct("<BB")
+
+# Interned layout (all integers little-endian):
+#   header:     MAGIC_INTERNED, letter count, shard count, word count (uint32s), pair count (uint64)
+#               followed by the letters and the three character shard names (ascii)
+#   blocks:     three zlib compressed blocks, each preceded by its compressed length (uint64):
+#               the words, sorted and joined by newlines (a word's ID is its position),
+#               the pair keys (first ID * (word count + 1) + second ID) sorted and stored as the differences
+#               between neighbours (uint64s), and the frequency of each pair (uint32s) in the same order.
+INTERNED_HEADER = struct.Struct("<8sIIIQ")
+BLOCK_LENGTH = struct.Struct("<Q")
+
+# Block layout (all integers little-endian), for dictionaries too big to sort or hold in memory (eg: 3-grams):
+#   header:     MAGIC_BLOCKS, shard count (uint32), letter count (uint32), directory position (uint64), letters (ascii)
+#   blocks:     each shard's entries sorted by ngram, as the text shards' "ngram\tfrequency[\tdecades]\n" lines (utf-8),
+#               cut into blocks of about BLOCK_SIZE bytes. A block is the length of its first ngram (uint16) and
+#               the ngram, then its lines zlib compressed.
+#   directory:  one entry per shard: name (3 bytes + 1 pad), first block number (uint32), block count (uint32)
+#   index:      the position of every block (uint64), then the position where the last one ends.
+BLOCKS_HEADER = struct.Struct("<8sIIQ")
+BLOCKS_DIRECTORY_ENTRY = struct.Struct("<3sxII")
+KEY_LENGTH = struct.Struct("<H")
+
+# Bloom filter layout: MAGIC_FILTER, shard count (uint32), bit count (uint64), hash count (uint32),
+# the three character shard names it covers (ascii), then the bits.
+FILTER_HEADER = struct.Struct("<8sIQI")
+
+
+def shard_name(s):
+    """Returns the three character shard name (eg: "th_") that a cleaned ngram is filed under."""
+    name = s[0:3].ljust(3, "_")
+    return name.replace(" ", "_")
+
+
+def parse_decades(decades):
+    """Turns a list of decade counts like "197:12,198:40" (decade = year // 10) into a dict."""
+    counts = {}
+    if decades != "":
+        for item in decades.split(","):
+            decade, count = item.split(":")
+            counts[int(decade)] = int(count)
+    return counts
+
+
+def format_decades(counts):
+    """The reverse of parse_decades."""
+    return ",".join("%i:%i" % (decade, counts[decade]) for decade in sorted(counts))
+
+
+def read_shard(file_name):
+    """Reads a text shard and returns its entries as a list of (ngram bytes, frequency, decades) sorted by ngram.
+    [decades] is the third column for dictionaries built with -decades, otherwise empty."""
+    entries = {}
+    in_file = codecs.open(file_name, 'r', 'utf-8')
+    for data_in in in_file:
+        data_list = data_in.rstrip("\n").split("\t")
+        if len(data_list) in (2, 3):
+            ngram = data_list[0].encode('utf-8')
+            if ngram not in entries:        # A linear scan only ever sees the first entry, so keep that one.
+                entries[ngram] = (int(data_list[1]), data_list[2] if len(data_list) == 3 else "")
+    in_file.close()
+    return [(ngram, value[0], value[1]) for ngram, value in sorted(entries.items())]
+
+
+def shard_ngrams(file_name):
+    """Yields the ngram (utf-8 bytes) of every entry in a text shard, a line at a time."""
+    in_file = codecs.open(file_name, 'r', 'utf-8')
+    for data_in in in_file:
+        data_list = data_in.split("\t")
+        if len(data_list) in (2, 3):
+            yield data_list[0].encode('utf-8')
+    in_file.close()
+
+
+def sorted_entries(file_name, run_size):
+    """Yields the entries of a text shard as (ngram, frequency, decades) sorted by ngram, keeping the first of any
+    duplicates as read_shard() does. At most [run_size] entries are held in memory; the rest are sorted on disk."""
+    import dictprocess      # Not at the top: dictprocess imports this module.
+    sorter = dictprocess.RunSorter(os.path.dirname(file_name) or ".", run_size, key=dictprocess.by_ngram)
+    for entry in dictprocess.read_entries(file_name):
+        sorter.add(entry)
+    last_ngram = None
+    for entry in sorter.merged():
+        if entry[0] != last_ngram:
+            last_ngram = entry[0]
+            yield entry
+
+
+def has_decades(shards):
+    """True if the text shards were built with -decades. (Judged by the first entry found.)"""
+    for name, file_name in shards:
+        in_file = codecs.open(file_name, 'r', 'utf-8')
+        data_in = in_file.readline()
+        in_file.close()
+        if data_in != "":
+            return len(data_in.split("\t")) == 3
+    return False
+
+
+def encode_record(ngram, frequency, decades, with_decades):
+    """Packs a single record."""
+    record = FREQUENCY.pack(min(frequency, 0xffffffff))
+    if with_decades:
+        counts = dict((decade - FIRST_DECADE, count) for decade, count in parse_decades(decades).items() if FIRST_DECADE <= decade < FIRST_DECADE + 256)
+        if len(counts) == 0:
+            record += DECADE_SPAN.pack(0, 0)
+        else:
+            first = min(counts)
+            span = max(counts) - first + 1
+            record += DECADE_SPAN.pack(first, span)
+            record += struct.pack("<%iI" % span, *[min(counts.get(first + i, 0), 0xffffffff) for i in range(span)])
+    return record + ngram
+
+
+def find_shards(dictionary_location):
+    """Returns the letters with a folder in [dictionary_location] and a list of (shard name, file name) for every shard."""
+    letters = ""
+    shards = []
+    for a in CHAR_LIST:
+        if os.path.isdir(dictionary_location + a):
+            letters += a
+            for b in CHAR_LIST:
+                for c in CHAR_LIST:
+                    file_name = dictionary_location + a + "/" + a + b + c + ".txt"
+                    if os.path.isfile(file_name):
+                        shards.append((a + b + c, file_name))
+    return letters, shards
+
+
+def split_ngram(ngram):
+    """Splits a cleaned ngram into its first word and the rest. [rest] is None if there's only the one word."""
+    if " " in ngram:
+        return ngram.split(" ", 1)
+    return ngram, None
+
+
+def write_block(out_file, data):
+    """Writes one length prefixed, zlib compressed block."""
+    data = zlib.compress(data, 9)
+    out_file.write(BLOCK_LENGTH.pack(len(data)))
+    out_file.write(data)
+
+
+def little_endian(values):
+    """The bytes of an array in little-endian order, whatever this machine uses."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def shard_group(name):
+    """The shards that can hold ngrams starting with the same word: "a__", "a_b", etc. for a one letter word."""
+    return name[0:2] if name[1] == "_" else name
+
+
+def compile_interned(dictionary_location):
+    """Converts the text shards in [dictionary_location] into a compiled file of word IDs. Returns the number of entries.
+    Decade counts (from -decades) aren't kept."""
+    letters, shards = find_shards(dictionary_location)
+    vocabulary = set()
+    for name, file_name in shards:
+        for ngram in shard_ngrams(file_name):
+            vocabulary.update(split_ngram(ngram.decode('utf-8')))
+    vocabulary.discard(None)
+    words = sorted(vocabulary, key=lambda word: word.encode('utf-8'))
+    word_ids = dict((word, i) for i, word in enumerate(words))
+    alone = len(words)      # The second "ID" of a single word ngram.
+
+    # Shards come in the same order as their first words, so the keys are sorted a shard at a time. The exception is
+    # a one letter first word, which is spread over several shards (eg: "a__" and "a_b") sorted together as a group.
+    deltas = array("Q")
+    frequencies = array("I")
+    last_key = 0
+    group = []
+    for i, (name, file_name) in enumerate(shards):
+        for ngram, frequency, decades in read_shard(file_name):
+            first, rest = split_ngram(ngram.decode('utf-8'))
+            group.append((word_ids[first] * (alone + 1) + (alone if rest is None else word_ids[rest]), min(frequency, 0xffffffff)))
+        if i + 1 < len(shards) and shard_group(shards[i + 1][0]) == shard_group(name):
+            continue
+        group.sort()
+        if len(group) > 0 and len(deltas) > 0 and group[0][0] <= last_key:
+            raise ValueError("The shards in [%s] aren't in the order of their words. (Around [%s].)" % (dictionary_location, name))
+        for key, frequency in group:
+            deltas.append(key - last_key)
+            frequencies.append(frequency)
+            last_key = key
+        group = []
+
+    out_name = dictionary_location + COMPILED_NAME
+    out_file = open(out_name + ".tmp", "wb")
+    out_file.write(INTERNED_HEADER.pack(MAGIC_INTERNED, len(letters), len(shards), len(words), len(frequencies)))
+    out_file.write(letters.encode('ascii'))
+    out_file.write("".join(name for name, file_name in shards).encode('ascii'))
+    write_block(out_file, "\n".join(words).encode('utf-8'))
+    write_block(out_file, little_endian(deltas))
+    write_block(out_file, little_endian(frequencies))
+    out_file.close()
+    os.replace(out_name + ".tmp", out_name)
+    return len(frequencies)
+
+
+def write_entry_block(out_file, lines):
+    """Writes one block of the block layout: its first ngram, then the (utf-8) [lines] compressed."""
+    first = lines[0].split(b"\t", 1)[0]
+    out_file.write(KEY_LENGTH.pack(len(first)) + first + zlib.compress(b"".join(lines), 9))
+
+
+def compile_blocks(dictionary_location, run_size=500000):
+    """Converts the text shards in [dictionary_location] into a compiled file of compressed blocks, a shard at a time
+    and never holding more than [run_size] entries in memory. Returns the number of entries."""
+    letters, shards = find_shards(dictionary_location)
+    with_decades = has_decades(shards)
+    out_name = dictionary_location + COMPILED_NAME
+    out_file = open(out_name + ".tmp", "wb")
+    out_file.write(BLOCKS_HEADER.pack(MAGIC_BLOCKS_DECADES if with_decades else MAGIC_BLOCKS, len(shards), len(letters), 0))
+    out_file.write(letters.encode('ascii'))
+
+    directory = []
+    positions = array("Q")
+    total = 0
+    for name, file_name in shards:
+        first_block = len(positions)
+        lines = []
+        size = 0
+        for ngram, frequency, decades in sorted_entries(file_name, run_size):
+            if decades != "":
+                line = (ngram + "\t" + str(frequency) + "\t" + decades + "\n").encode('utf-8')
+            else:
+                line = (ngram + "\t" + str(frequency) + "\n").encode('utf-8')
+            lines.append(line)
+            size += len(line)
+            if size >= BLOCK_SIZE:
+                positions.append(out_file.tell())
+                write_entry_block(out_file, lines)
+                total += len(lines)
+                lines = []
+                size = 0
+        if len(lines) > 0:
+            positions.append(out_file.tell())
+            write_entry_block(out_file, lines)
+            total += len(lines)
+        directory.append(BLOCKS_DIRECTORY_ENTRY.pack(name.encode('ascii'), first_block, len(positions) - first_block))
+
+    directory_position = out_file.tell()
+    positions.append(directory_position)    # Where the last block ends.
+    out_file.write(b"".join(directory))
+    out_file.write(little_endian(positions))
+    out_file.seek(0)
+    out_file.write(BLOCKS_HEADER.pack(MAGIC_BLOCKS_DECADES if with_decades else MAGIC_BLOCKS, len(shards), len(letters), directory_position))
+    out_file.close()
+    os.replace(out_name + ".tmp", out_name)
+    return total
+
+
+def compile_dictionary(dictionary_location, interned=False, blocks=False):
+    """Converts the text shards in [dictionary_location] into a single compiled file. Returns the number of entries."""
+    if interned:
+        return compile_interned(dictionary_location)
+    if blocks:
+        return compile_blocks(dictionary_location)
+    letters, shards = find_shards(dictionary_location)
+    with_decades = has_decades(shards)
+    out_name = dictionary_location + COMPILED_NAME
+    out_file = open(out_name + ".tmp", "wb")
+    out_file.write(HEADER.pack(MAGIC_DECADES if with_decades else MAGIC, len(shards), len(letters)))
+    out_file.write(letters.encode('ascii'))
+    directory_position = out_file.tell()
+    out_file.write(b"\0" * (DIRECTORY_ENTRY.size * len(shards)))     # Filled in once we know where everything is.
+
+    directory = []
+    total = 0
+    for name, file_name in shards:
+        records = [encode_record(ngram, frequency, decades, with_decades) for ngram, frequency, decades in read_shard(file_name)]
+        table_position = out_file.tell()
+        record_position = table_position + OFFSET.size * (len(records) + 1)
+        offsets = []
+        for record in records:
+            offsets.append(OFFSET.pack(record_position))
+            record_position += len(record)
+        offsets.append(OFFSET.pack(record_position))
+        out_file.write(b"".join(offsets))
+        out_file.write(b"".join(records))
+        directory.append(DIRECTORY_ENTRY.pack(name.encode('ascii'), table_position, len(records)))
+        total += len(records)
+
+    out_file.seek(directory_position)
+    out_file.write(b"".join(directory))
+    out_file.close()
+    os.replace(out_name + ".tmp", out_name)
+    return total
+
+
+class CompiledDictionary(object):
+    """A memory-mapped compiled dictionary. Lookups are a binary search within the ngram's shard."""
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, shard_count, letter_count = HEADER.unpack_from(self.data, 0)
+        if magic not in (MAGIC, MAGIC_DECADES):
+            raise ValueError("[%s] is not a compiled ingram dictionary." % file_name)
+        self.decades = magic == MAGIC_DECADES
+        position = HEADER.size
+        self.letters = self.data[position:position + letter_count].decode('ascii')
+        position += letter_count
+        self.shards = {}
+        for i in range(shard_count):
+            name, table_position, count = DIRECTORY_ENTRY.unpack_from(self.data, position)
+            self.shards[name.decode('ascii')] = (table_position, count)
+            position += DIRECTORY_ENTRY.size
+
+    def frequency(self, s, years=None):
+        """Reports the raw frequency of the cleaned ngram [s]. None if there's no shard for it.
+        [years] is an optional (first year, last year) range, rounded out to whole decades. It needs a -decades dictionary."""
+        shard = self.shards.get(shard_name(s))
+        if shard is None:
+            if s[0] in self.letters:
+                return None     # No dictionary found for this guy.
+            return 0
+        table_position, count = shard
+        key = s.encode('utf-8')
+        data = self.data
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            start, end = struct.unpack_from("<QQ", data, table_position + middle * OFFSET.size)
+            key_start = start + FREQUENCY.size
+            if self.decades:
+                key_start += DECADE_SPAN.size + FREQUENCY.size * data[key_start + 1]
+            ngram = data[key_start:end]
+            if ngram < key:
+                low = middle + 1
+            elif ngram > key:
+                high = middle
+            elif years is None:
+                return FREQUENCY.unpack_from(data, start)[0]
+            else:
+                return self.decade_total(start, years)
+        return 0
+
+    def decade_total(self, start, years):
+        """Adds up the counts of the record at [start] for the decades that overlap [years]."""
+        first, span = DECADE_SPAN.unpack_from(self.data, start + FREQUENCY.size)
+        low = max(years[0] // 10 - FIRST_DECADE, first)
+        high = min(years[1] // 10 - FIRST_DECADE, first + span - 1)
+        if low > high:
+            return 0
+        counts_position = start + FREQUENCY.size + DECADE_SPAN.size
+        return sum(struct.unpack_from("<%iI" % (high - low + 1), self.data, counts_position + FREQUENCY.size * (low - first)))
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+class InternedDictionary(object):
+    """A compiled dictionary of word IDs, read entirely into memory. Lookups turn both words into IDs and
+    binary search the sorted pair keys."""
+
+    decades = False
+
+    def __init__(self, file_name):
+        in_file = open(file_name, "rb")
+        magic, letter_count, shard_count, word_count, pair_count = INTERNED_HEADER.unpack(in_file.read(INTERNED_HEADER.size))
+        if magic != MAGIC_INTERNED:
+            raise ValueError("[%s] is not an interned ingram dictionary." % file_name)
+        self.letters = in_file.read(letter_count).decode('ascii')
+        names = in_file.read(3 * shard_count).decode('ascii')
+        self.shards = set(names[i:i + 3] for i in range(0, len(names), 3))
+        words = self.read_block(in_file).decode('utf-8')
+        self.word_ids = dict((word, i) for i, word in enumerate(words.split("\n"))) if word_count > 0 else {}
+        self.alone = word_count
+        self.keys = array("Q", itertools.accumulate(self.read_array(in_file, "Q")))
+        self.frequencies = self.read_array(in_file, "I")
+        in_file.close()
+        if len(self.keys) != pair_count or len(self.frequencies) != pair_count:
+            raise ValueError("[%s] is damaged." % file_name)
+
+    def read_block(self, in_file):
+        length = BLOCK_LENGTH.unpack(in_file.read(BLOCK_LENGTH.size))[0]
+        return zlib.decompress(in_file.read(length))
+
+    def read_array(self, in_file, typecode):
+        values = array(typecode)
+        values.frombytes(self.read_block(in_file))
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def frequency(self, s, years=None):
+        """Reports the raw frequency of the cleaned ngram [s]. None if there's no shard for it. [years] isn't supported."""
+        if shard_name(s) not in self.shards:
+            if s[0] in self.letters:
+                return None     # No dictionary found for this guy.
+            return 0
+        first, rest = split_ngram(s)
+        first_id = self.word_ids.get(first)
+        second_id = self.alone if rest is None else self.word_ids.get(rest)
+        if first_id is None or second_id is None:
+            return 0
+        key = first_id * (self.alone + 1) + second_id
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.frequencies[i]
+        return 0
+
+    def close(self):
+        self.keys = None
+        self.frequencies = None
+        self.word_ids = None
+
+
+class BlockDictionary(object):
+    """A memory-mapped dictionary of compressed blocks. Lookups binary search the first ngrams of the shard's blocks,
+    then decompress just the block the ngram would be in."""
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, shard_count, letter_count, directory_position = BLOCKS_HEADER.unpack_from(self.data, 0)
+        if magic not in (MAGIC_BLOCKS, MAGIC_BLOCKS_DECADES):
+            raise ValueError("[%s] is not a block compiled ingram dictionary." % file_name)
+        self.decades = magic == MAGIC_BLOCKS_DECADES
+        self.letters = self.data[BLOCKS_HEADER.size:BLOCKS_HEADER.size + letter_count].decode('ascii')
+        self.shards = {}
+        position = directory_position
+        for i in range(shard_count):
+            name, first_block, count = BLOCKS_DIRECTORY_ENTRY.unpack_from(self.data, position)
+            self.shards[name.decode('ascii')] = (first_block, count)
+            position += BLOCKS_DIRECTORY_ENTRY.size
+        self.index_position = position
+
+    def first_ngram(self, block):
+        """The first ngram (utf-8 bytes) in block number [block], and where its compressed lines start."""
+        start = OFFSET.unpack_from(self.data, self.index_position + block * OFFSET.size)[0]
+        end = start + KEY_LENGTH.size + KEY_LENGTH.unpack_from(self.data, start)[0]
+        return self.data[start + KEY_LENGTH.size:end], end
+
+    def frequency(self, s, years=None):
+        """Reports the raw frequency of the cleaned ngram [s]. None if there's no shard for it.
+        [years] is an optional (first year, last year) range, rounded out to whole decades. It needs a -decades dictionary."""
+        shard = self.shards.get(shard_name(s))
+        if shard is None:
+            if s[0] in self.letters:
+                return None     # No dictionary found for this guy.
+            return 0
+        first_block, count = shard
+        key = s.encode('utf-8')
+        # Find the last block that starts at or before the key.
+        low = first_block
+        high = first_block + count
+        while low < high:
+            middle = (low + high) // 2
+            if self.first_ngram(middle)[0] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == first_block:
+            return 0
+        lines_start = self.first_ngram(low - 1)[1]
+        lines_end = OFFSET.unpack_from(self.data, self.index_position + low * OFFSET.size)[0]
+        lines = b"\n" + zlib.decompress(self.data[lines_start:lines_end])
+        found = lines.find(b"\n" + key + b"\t")
+        if found < 0:
+            return 0
+        data_list = lines[found + 1:lines.index(b"\n", found + 1)].decode('utf-8').split("\t")
+        if years is None:
+            return int(data_list[1])
+        counts = parse_decades(data_list[2]) if len(data_list) == 3 else {}
+        return sum(count for decade, count in counts.items() if years[0] // 10 <= decade <= years[1] // 10)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+class BloomFilter(object):
+    """Remembers which ngrams are in the dictionary in about a byte each. It can be wrong about an ngram
+    being there (at the rate it was built for) but never about one being missing."""
+
+    def __init__(self, bits, hashes, shards, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.shards = shards
+        self.data = bytearray((bits + 7) // 8) if data is None else data
+
+    def positions(self, key):
+        """The bits for [key] (utf-8 bytes), by double hashing one digest."""
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[0:8], "little")
+        step = int.from_bytes(digest[8:16], "little") | 1
+        return [(first + i * step) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for bit in self.positions(key):
+            self.data[bit >> 3] |= 1 << (bit & 7)
+
+    def might_contain(self, s):
+        """False if the cleaned ngram [s] is certainly not in the dictionary. Ngrams filed in shards the filter
+        doesn't cover (including ones with no shard) are always a maybe."""
+        if shard_name(s) not in self.shards:
+            return True
+        data = self.data
+        for bit in self.positions(s.encode('utf-8')):
+            if not data[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+def build_filter(dictionary_location, false_positive_rate=0.01):
+    """Writes a Bloom filter of every ngram in the text shards in [dictionary_location]. Returns the number of entries."""
+    letters, shards = find_shards(dictionary_location)
+    total = 0
+    for name, file_name in shards:
+        total += sum(1 for ngram in shard_ngrams(file_name))
+    bits = max(int(math.ceil(-total * math.log(false_positive_rate) / (math.log(2) ** 2))), 8)
+    hashes = max(int(round(bits / float(max(total, 1)) * math.log(2))), 1)
+    bloom = BloomFilter(bits, hashes, set(name for name, file_name in shards))
+    for name, file_name in shards:
+        for ngram in shard_ngrams(file_name):
+            bloom.add(ngram)
+
+    out_name = dictionary_location + FILTER_NAME
+    out_file = open(out_name + ".tmp", "wb")
+    out_file.write(FILTER_HEADER.pack(MAGIC_FILTER, len(shards), bits, hashes))
+    out_file.write("".join(name for name, file_name in shards).encode('ascii'))
+    out_file.write(bloom.data)
+    out_file.close()
+    os.replace(out_name + ".tmp", out_name)
+    return total
+
+
+def open_filter(dictionary_location):
+    """Loads the Bloom filter in [dictionary_location]. Returns None if there isn't one."""
+    file_name = dictionary_location + FILTER_NAME
+    if not os.path.isfile(file_name):
+        return None
+    in_file = open(file_name, "rb")
+    magic, shard_count, bits, hashes = FILTER_HEADER.unpack(in_file.read(FILTER_HEADER.size))
+    if magic != MAGIC_FILTER:
+        in_file.close()
+        raise ValueError("[%s] is not an ingram filter." % file_name)
+    names = in_file.read(3 * shard_count).decode('ascii')
+    data = bytearray(in_file.read())
+    in_file.close()
+    if len(data) != (bits + 7) // 8:
+        raise ValueError("[%s] is damaged." % file_name)
+    return BloomFilter(bits, hashes, set(names[i:i + 3] for i in range(0, len(names), 3)), data)
+
+
+def open_compiled(dictionary_location):
+    """Opens the compiled dictionary in [dictionary_location]. Returns None if it hasn't been compiled."""
+    file_name = dictionary_location + COMPILED_NAME
+    if os.path.isfile(file_name):
+        in_file = open(file_name, "rb")
+        magic = in_file.read(len(MAGIC_INTERNED))
+        in_file.close()
+        if magic == MAGIC_INTERNED:
+            return InternedDictionary(file_name)
+        if magic in (MAGIC_BLOCKS, MAGIC_BLOCKS_DECADES):
+            return BlockDictionary(file_name)
+        return CompiledDictionary(file_name)
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a text dictionary made by dictprocess.py into ingram's binary format.")
+    parser.add_argument('-dict', help="Dictionary to compile. (default /dictionary/)", required=False, default="dictionary/", metavar="PATH")
+    parser.add_argument('-interned', help="Store each word once and word pairs as pairs of word IDs. Several times smaller and held entirely in memory, but doesn't keep -decades counts.", action="store_true")
+    parser.add_argument('-blocks', help="Store the sorted entries in compressed blocks with an index of the blocks. Built a piece at a time in limited memory and several times smaller than the default, for very big dictionaries such as 3-grams. Lookups are a little slower.", action="store_true")
+    parser.add_argument('-fprate', help="False positive rate of the Bloom filter that lets missing word pairs skip the dictionary. 0 doesn't make one. (Default: 0.01)", default=0.01, type=float, required=False, metavar="RATE")
+    config = vars(parser.parse_args())
+
+    if not os.path.exists(config["dict"]):
+        print("Error: No dictionary found in path [%s]." % config["dict"])
+        exit(1)
+    if not 0 <= config["fprate"] < 1:
+        print("Error: -fprate must be at least 0 and less than 1.")
+        exit(1)
+    if config["interned"] and config["blocks"]:
+        print("Error: Use -interned or -blocks, not both.")
+        exit(1)
+    print("Compiled %i entries into [%s]." % (compile_dictionary(config["dict"], config["interned"], config["blocks"]), config["dict"] + COMPILED_NAME))
+    if config["fprate"] > 0:
+        print("Filtered %i entries into [%s]." % (build_filter(config["dict"], config["fprate"]), config["dict"] + FILTER_NAME))
+    elif os.path.isfile(config["dict"] + FILTER_NAME):
+        os.remove(config["dict"] + FILTER_NAME)     # An old filter would hide anything added since.
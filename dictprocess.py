@@ -3,9 +3,20 @@ import os
 import sys
 import codecs
 import gzip
+import multiprocessing
+import multiprocessing.connection
+import queue
+import heapq
+import itertools
+import json
+import signal
+import tempfile
+import threading
 import time
-from operator import itemgetter
-from process_dict import *
+from cleanstring import *
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from compiledict import format_decades, parse_decades, shard_name
 
 
 def clean_exit(config):
@@ -25,152 +36,680 @@ def cleanup(config):
                 fname = config["outpath"] + a + "/" + config["ip_file_name"] + a + b + ".txt"
                 if os.path.isfile(fname):
                     print("Removing partial dictionary for [" + a + b + "].")
-                    for c in config["char_list"]:
-                        tname = config["outpath"] + a + "/" + a + b + c + ".txt"
-                        if os.path.isfile(tname):
-                            os.remove(tname)
-                    os.remove(fname)
+                    remove_partial(config, config["outpath"], a, b)
+            for fname in os.listdir(config["outpath"] + a + "/"):
+                if fname.startswith("_sorting_"):        # Leftovers from sorting a big file.
+                    os.remove(config["outpath"] + a + "/" + fname)
+
+
+def remove_partial(config, outpath, a, b):
+    """Removes the output files and in-progress marker for the source file [a][b]."""
+    for c in config["char_list"]:
+        tname = outpath + "/" + a + "/" + a + b + c + ".txt"
+        if os.path.isfile(tname):
+            os.remove(tname)
+    tname = checkpoint_name(config, outpath, a, b)
+    if os.path.isfile(tname):
+        os.remove(tname)
+    fname = outpath + "/" + a + "/" + config["fr_file_name"] + a + b + ".txt"
+    if os.path.isfile(fname):
+        os.remove(fname)
+    fname = outpath + "/" + a + "/" + config["ip_file_name"] + a + b + ".txt"
+    if os.path.isfile(fname):
+        os.remove(fname)
+
+
+def checkpoint_name(config, outpath, a, b):
+    """The file that records how far processing the source file [a][b] got."""
+    return outpath + "/" + a + "/" + config["cp_file_name"] + a + b + ".json"
+
+
+def checkpoint_settings(config):
+    """The options that decide what's written, so a checkpoint made with different ones isn't resumed."""
+    return {"startyear": config["startyear"], "endyear": config["endyear"], "decades": config["decades"],
+            "minfreq": config["minfreq"], "minpubs": config["minpubs"], "map": config["map"], "trigrams": config["trigrams"]}
+
+
+def load_checkpoint(config, outpath, a, b):
+    """Returns the last checkpoint saved while processing [a][b], or None if there isn't a usable one."""
+    fname = checkpoint_name(config, outpath, a, b)
+    if not os.path.isfile(fname):
+        return None
+    try:
+        in_file = codecs.open(fname, 'r', 'utf-8')
+        try:
+            checkpoint = json.load(in_file)
+        finally:
+            in_file.close()
+        if checkpoint["settings"] != checkpoint_settings(config):
+            return None
+        for key in ["lines", "last_pair", "running_total", "decades", "pub_count", "sizes"]:
+            checkpoint[key]
+        if not all(name.endswith(".txt") for name in checkpoint["sizes"]):
+            return None
+        # Resuming cuts each file back to its size at the checkpoint. One that's shorter lost data since.
+        for name, size in checkpoint["sizes"].items():
+            if size > 0 and (not os.path.isfile(outpath + "/" + a + "/" + name) or os.path.getsize(outpath + "/" + a + "/" + name) < size):
+                return None
+    except (ValueError, KeyError, TypeError):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(config, outpath, a, b, checkpoint):
+    """Records how far processing [a][b] has got. Everything written before it must already be on disk."""
+    fname = checkpoint_name(config, outpath, a, b)
+    checkpoint["settings"] = checkpoint_settings(config)
+    out_file = codecs.open(fname + ".tmp", 'w', 'utf-8')
+    json.dump(checkpoint, out_file)
+    out_file.flush()
+    os.fsync(out_file.fileno())
+    out_file.close()
+    os.replace(fname + ".tmp", fname)
 
 
-def file_consolidate(filename):
-    """ Consolidates duplicates and sorts by frequency for speedy lookup. """
-    # TODO: Really big files should not be loaded fully into memory to sort them.
-    # TODO: Make it more robust, actually checking for errors, etc.
+def sync_files(file_names):
+    """Makes sure everything written to [file_names] has reached the disk, not just the OS's cache."""
+    for file_name in file_names:
+        out_file = open(file_name, 'ab')
+        os.fsync(out_file.fileno())
+        out_file.close()
+
 
-    sorting_hat = []
+def read_entries(filename):
+    """ Yields (ngram, frequency, decades) for each well formed line of a dictionary file.
+    [decades] is only filled in for dictionaries built with -decades."""
     in_file = codecs.open(filename, 'r', 'utf-8')
     for data_in in in_file:
-        sorting_hat.append(data_in)
+        split_data = data_in.split("\t")
+        if len(split_data) == 2:
+            yield (split_data[0], int(split_data[1]), "")
+        elif len(split_data) == 3:
+            yield (split_data[0], int(split_data[1]), split_data[2].rstrip("\n"))
     in_file.close()
-    sorting_hat.sort()      # Put all the duplicate entires next to each other.
 
-    # Consolidate duplicates while writing to an external file.
-    old_ngram = ""
-    old_total = 0
-    out_file = codecs.open(filename+".tmp", 'w', 'utf-8')
-    for i in sorting_hat:
-        line = i.split("\t")
-        if old_ngram == line[0]:
-            old_total += int(line[1])
-        else:
-            if old_ngram != "" and old_total > 0:
-                out_file.write(old_ngram)
-                out_file.write("\t")
-                out_file.write(str(old_total))
-                out_file.write("\n")
-            old_ngram = line[0]
-            old_total = int(line[1])
-    out_file.write(old_ngram)
-    out_file.write("\t")
-    out_file.write(str(old_total))
-    out_file.write("\n")
 
+def write_entries(filename, entries):
+    """ Writes (ngram, frequency, decades) entries out as a dictionary file. Returns how many were written."""
+    count = 0
+    out_file = codecs.open(filename, 'w', 'utf-8')
+    for ngram, value, decades in entries:
+        if decades != "":
+            out_file.write(ngram + "\t" + str(value) + "\t" + decades + "\n")
+        else:
+            out_file.write(ngram + "\t" + str(value) + "\n")
+        count += 1
     out_file.close()
-    os.remove(filename)
-    os.rename(filename+".tmp", filename)
+    return count
+
 
-    # Now sort it by frequency for high-speed lookups. TODO: put this in with the consolidation loop above.
+def read_run(filename):
+    """ Yields (ngram, frequency, publications, decades) for each line of a -map run file."""
     in_file = codecs.open(filename, 'r', 'utf-8')
-    sorting_hat = []
     for data_in in in_file:
-        split_data = data_in.split("\t")
-        if len(split_data) == 2:
-            data_dict = {"name": split_data[0], "value": int(split_data[1])}
-            sorting_hat.append(data_dict)
+        split_data = data_in.rstrip("\n").split("\t")
+        if len(split_data) == 4:
+            yield (split_data[0], int(split_data[1]), int(split_data[2]), split_data[3])
     in_file.close()
-    sorting_hat.sort(key=itemgetter('value'), reverse=True)
-    out_file = codecs.open(filename + ".tmp", 'w', 'utf-8')
-    for item in sorting_hat:
-        out_file.write(item["name"])
-        out_file.write("\t")
-        out_file.write(str(item["value"]))
-        out_file.write("\n")
+
+
+def write_run(filename, entries):
+    """ Writes (ngram, frequency, publications, decades) entries out as a -map run file. Returns how many were written."""
+    count = 0
+    out_file = codecs.open(filename, 'w', 'utf-8')
+    for ngram, value, pubs, decades in entries:
+        out_file.write(ngram + "\t" + str(value) + "\t" + str(pubs) + "\t" + decades + "\n")
+        count += 1
     out_file.close()
+    return count
+
+
+class RunSorter(object):
+    """Sorts more entries than fit in memory by spilling sorted runs to temporary files and merging them back."""
+
+    def __init__(self, path, run_size, key=None, reader=read_entries, writer=write_entries):
+        self.path = path
+        self.run_size = run_size
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.run = []
+        self.run_files = []
+
+    def add(self, entry):
+        self.run.append(entry)
+        if len(self.run) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        """ Writes the current run out to a temporary file."""
+        self.run.sort(key=self.key)
+        handle, run_name = tempfile.mkstemp(prefix="_sorting_", suffix=".txt", dir=self.path)
+        os.close(handle)
+        self.writer(run_name, self.run)
+        self.run_files.append(run_name)
+        self.run = []
+
+    def merged(self):
+        """ Yields every entry added, in order. Small jobs never touch the disk."""
+        self.run.sort(key=self.key)
+        if len(self.run_files) == 0:
+            for entry in self.run:
+                yield entry
+            return
+        runs = [self.reader(run_name) for run_name in self.run_files]
+        runs.append(iter(self.run))
+        try:
+            for entry in heapq.merge(*runs, key=self.key):
+                yield entry
+        finally:
+            self.run = []
+            for run in runs[:-1]:
+                run.close()
+            for run_name in self.run_files:
+                os.remove(run_name)
+            self.run_files = []
+
+
+def by_frequency(entry):
+    """ Sort key putting the most frequent entries first. (Ties are alphabetical.)"""
+    return (-entry[1], entry[0])
+
+
+def file_consolidate(filename, run_size=500000):
+    """ Consolidates duplicates and sorts by frequency for speedy lookup, holding at most [run_size] entries in memory. """
+    # TODO: Make it more robust, actually checking for errors, etc.
+    path = os.path.dirname(filename) or "."
+
+    # Put all the duplicate entries next to each other.
+    by_name = RunSorter(path, run_size)
+    for entry in read_entries(filename):
+        by_name.add(entry)
+
+    # Consolidate duplicates while sorting them by frequency for high-speed lookups.
+    sorting_hat = RunSorter(path, run_size, key=by_frequency)
+    old_ngram = ""
+    old_total = 0
+    old_decades = {}
+    for ngram, value, decades in by_name.merged():
+        if old_ngram == ngram:
+            old_total += value
+        else:
+            if old_ngram != "" and old_total > 0:
+                sorting_hat.add((old_ngram, old_total, format_decades(old_decades)))
+            old_ngram = ngram
+            old_total = value
+            old_decades = {}
+        for decade, count in parse_decades(decades).items():
+            old_decades[decade] = old_decades.get(decade, 0) + count
+    if old_ngram != "" and old_total > 0:
+        sorting_hat.add((old_ngram, old_total, format_decades(old_decades)))
+
+    count = write_entries(filename + ".tmp", sorting_hat.merged())
     os.remove(filename)
     os.rename(filename + ".tmp", filename)
+    return count
 
-    return len(sorting_hat)
 
+def sum_runs(entries):
+    """ Adds up neighboring (ngram, frequency, publications, decades) entries for the same ngram. Yields the totals."""
+    old_ngram = ""
+    old_total = 0
+    old_pubs = 0
+    old_decades = {}
+    for ngram, value, pubs, decades in entries:
+        if old_ngram == ngram:
+            old_total += value
+            old_pubs += pubs
+        else:
+            if old_ngram != "" and old_total > 0:
+                yield (old_ngram, old_total, old_pubs, format_decades(old_decades))
+            old_ngram = ngram
+            old_total = value
+            old_pubs = pubs
+            old_decades = {}
+        for decade, count in parse_decades(decades).items():
+            old_decades[decade] = old_decades.get(decade, 0) + count
+    if old_ngram != "" and old_total > 0:
+        yield (old_ngram, old_total, old_pubs, format_decades(old_decades))
+
+
+def run_consolidate(filename, run_size=500000):
+    """ file_consolidate() for -map: merges duplicates but keeps the publication counts and leaves the file sorted by
+    ngram, ready to be merged with other runs. """
+    path = os.path.dirname(filename) or "."
+    by_name = RunSorter(path, run_size, reader=read_run, writer=write_run)
+    for entry in read_run(filename):
+        by_name.add(entry)
+    count = write_run(filename + ".tmp", sum_runs(by_name.merged()))
+    os.remove(filename)
+    os.rename(filename + ".tmp", filename)
+    return count
 
-def process_dict(source_name, outpath, a, b):
-    """ Rend a single source n-gram file down to the bare bones that we need. """
 
-    # Be sure the destination folder exists
-    if not os.path.exists(outpath + "/" + a + "/"):
-        os.makedirs(outpath + "/" + a + "/", mode=0o755)
+def by_ngram(entry):
+    return entry[0]
+
 
-    # Does "in progress" file exist? If so, skip (probably being worked on by another thread.)
-    ip_file_name = outpath + "/" + a + "/_currently_woring_on_" + a + b + ".txt"
-    if os.path.isfile(ip_file_name):
-        return
+def reduce_shard(config, runs, filename, extra=()):
+    """ Merges the sorted -map [runs] (and the sorted [extra] entries) for one dictionary file into [filename], adding up
+    each ngram's counts and keeping those over -minfreq and -minpubs, sorted by frequency. Returns the number of
+    entries written."""
+    sorting_hat = RunSorter(os.path.dirname(filename) or ".", config["sort_run"], key=by_frequency)
+    readers = [read_run(run_name) for run_name in runs] + [iter(extra)]
+    for ngram, value, pubs, decades in sum_runs(heapq.merge(*readers, key=by_ngram)):
+        if value >= config["minfreq"] and pubs >= config["minpubs"]:
+            sorting_hat.add((ngram, value, decades))
+    count = write_entries(filename + ".tmp", sorting_hat.merged())
+    if os.path.isfile(filename):
+        os.remove(filename)
+    os.rename(filename + ".tmp", filename)
+    return count
+
+
+def reduce_job(job):
+    return reduce_shard(*job)
+
+
+def start_reduce(config):
+    """ -reduce: merges every set of runs made by -map into a finished dictionary in -outpath. Returns True if it worked."""
+    shards = {}     # "a/abc.txt" -> the run files for it
+    foreign = {}    # "a/abc.txt" -> entries for it from other source files' runs (there aren't many.)
+    for run_path in config["reduce"]:
+        run_path = os.path.join(run_path, "")
+        if not os.path.isdir(run_path):
+            print("Error: Run path [%s] not found." % run_path)
+            return False
+        for a in config["char_list"]:
+            if os.path.isdir(run_path + a):
+                for fname in sorted(os.listdir(run_path + a)):
+                    if fname.startswith(config["ip_file_name"]):
+                        print("Error: [%s] is still in progress in [%s]. Finish (-resume) or -cleanup it first." % (fname[len(config["ip_file_name"]):-4], run_path))
+                        return False
+                    if fname.startswith(config["fr_file_name"]):
+                        for entry in read_run(run_path + a + "/" + fname):
+                            foreign.setdefault(a + "/" + shard_name(entry[0]) + ".txt", []).append(entry)
+                    elif fname.endswith(".txt") and not fname.startswith((config["cp_file_name"], "_sorting_")):
+                        shards.setdefault(a + "/" + fname, []).append(run_path + a + "/" + fname)
+    for name in foreign:
+        shards.setdefault(name, [])
+    if len(shards) == 0:
+        print("Note: No runs found to reduce.")
+        return True
+
+    jobs = []
+    for name in sorted(shards):
+        if not os.path.exists(config["outpath"] + name[0]):
+            os.makedirs(config["outpath"] + name[0], mode=0o755)
+        jobs.append((config, shards[name], config["outpath"] + name, sorted(foreign.get(name, []))))
+    print("Reducing %i dictionary files from %i run sets." % (len(jobs), len(config["reduce"])))
+    start_time = time.time()
+    if config["workers"] > 1:
+        # Unlike multiprocessing.Pool, the executor notices a worker that dies (eg: killed for using too much memory.)
+        pool = ProcessPoolExecutor(config["workers"], initializer=ignore_interrupt)
+        try:
+            out_count = sum(pool.map(reduce_job, jobs))
+        except BrokenProcessPool:
+            print("Error: A worker process died. Reduce again to finish the dictionary.")
+            return False
+        finally:
+            pool.shutdown(cancel_futures=True)
     else:
-        start_time = time.clock()
-        print ("Processing ["+a+b+"]. Started at " + time.asctime(time.localtime())+".")
+        out_count = sum(reduce_job(job) for job in jobs)
+    print("Reduced to %i entries in %.1f seconds." % (out_count, time.time() - start_time))
+    return True
+
+
+class ShardWriter(object):
+    """Collects dictionary entries in memory and appends them to their files in large blocks."""
 
-        out_file = codecs.open(ip_file_name, "w")    # Create the "in progress" file just in case the process gets interrupted.
-        out_file.write("This file will be removed when processing this dictionary entry (" + a + b + ") is complete.")
+    def __init__(self, path, flush_size):
+        self.path = path
+        self.flush_size = flush_size
+        self.buffers = {}       # file name -> list of pending lines
+        self.sizes = {}         # file name -> characters pending
+
+    def write(self, file_name, line):
+        """Queues [line] for [file_name], writing the file's buffer out if it's gotten big."""
+        if file_name in self.buffers:
+            self.buffers[file_name].append(line)
+            self.sizes[file_name] += len(line)
+        else:
+            self.buffers[file_name] = [line]
+            self.sizes[file_name] = len(line)
+        if self.sizes[file_name] >= self.flush_size:
+            self.flush(file_name)
+
+    def flush(self, file_name):
+        """Appends everything pending for [file_name] in a single write."""
+        out_file = codecs.open(self.path + file_name + ".txt", 'a', 'utf-8')
+        out_file.write("".join(self.buffers[file_name]))
         out_file.close()
+        del self.buffers[file_name]
+        del self.sizes[file_name]
 
-        # Create empty files to append entries to
-        for c in config["char_list"]:
-            out_file = codecs.open(outpath + "/" + a + "/" + a + b + c + ".txt", 'w', 'utf-8')
-            out_file.close()
+    def flush_all(self):
+        """Writes out everything pending."""
+        for file_name in sorted(self.buffers):
+            self.flush(file_name)
 
-        # Process the input file
-        in_file = gzip.open(source_name, "r")
-        last_pair = ""
-        running_total = 0
-        pub_count = 0
-        in_count = 0
-        for data_in in in_file:
-            data_in = data_in.decode('utf-8')
-            in_count += 1
-            if in_count % 100000 == 0:
-                sys.stdout.write('.')
-                sys.stdout.flush()
-            ngram_data = data_in.split("\t")
-            this_pair = ngram_data[0]
-            this_pair = clean_string(this_pair)
-            if this_pair is not None:
-                this_year = int(ngram_data[1])
-                this_count = int(ngram_data[2])
-                pub_count += int(ngram_data[3])
-                if this_pair == last_pair:       # Same as the last, keep adding them up.
-                    if this_year >= config["startyear"] and this_year <= config["endyear"]:   # If the year is good, add the count
-                        running_total += this_count
-                else:   # It's a new ngram. Save the old one.
-                    if running_total >= config["minfreq"] and pub_count >= config["minpubs"]:   # If we have enough of them add it to the dictionary
-                        out_file_name = last_pair[0:3]
-                        out_file_name = out_file_name.ljust(3, "_")
-                        out_file_name = out_file_name.replace(" ", "_")
-                        out_file = codecs.open(outpath + "/" + a + "/" + out_file_name + ".txt", 'a', 'utf-8')
-                        out_file.write(last_pair)
-                        out_file.write("\t")
-                        out_file.write(str(running_total))
-                        out_file.write("\n")
-                        out_file.close()
-                    last_pair = this_pair
-                    running_total = 0
-                    pub_count = 0
+    def close(self):
+        """Writes out everything still pending."""
+        self.flush_all()
+
+
+def parse_lines(lines):
+    """ Splits and cleans source lines (bytes.) Returns a list of (cleaned ngram, year, match count, volume count)."""
+    rows = [data_in.decode('utf-8').split("\t") for data_in in lines]
+    return [(cleaned, int(row[1]), int(row[2]), int(row[3])) for cleaned, row in zip(clean_strings([row[0] for row in rows]), rows)]
+
+
+def parse_block(block):
+    """ parse_lines() for a block of whole lines read in one piece."""
+    lines = block.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    return parse_lines(lines)
+
+
+def read_ngrams(source_name, block_size, skip=0):
+    """ Yields (cleaned ngram, year, match count, volume count) for each line of a source file after the first [skip],
+    cleaning them a block of lines at a time."""
+    in_file = gzip.open(source_name, "r")
+    try:
+        next(itertools.islice(in_file, skip, skip), None)       # Reads past [skip] lines without keeping them.
+        while True:
+            block = list(itertools.islice(in_file, block_size))
+            if len(block) == 0:
+                break
+            for row in parse_lines(block):
+                yield row
+    finally:
         in_file.close()
 
-        # Optimize the new files (merge duplicates)
+
+def read_blocks(source_name, block_bytes, blocks, errors, skip=0):
+    """ Decompresses a source file (after the first [skip] lines) onto the [blocks] queue in blocks of whole lines,
+    then None. Runs in its own thread (zlib lets other threads run while it works.) Anything that goes wrong is
+    added to [errors]."""
+    try:
+        in_file = gzip.open(source_name, "r")
+        try:
+            next(itertools.islice(in_file, skip, skip), None)
+            rest = b""
+            while True:
+                data = in_file.read(block_bytes)
+                if len(data) == 0:
+                    break
+                data = rest + data
+                cut = data.rfind(b"\n") + 1
+                if cut > 0:
+                    blocks.put(data[:cut])
+                rest = data[cut:]
+            if len(rest) > 0:
+                blocks.put(rest)
+        finally:
+            in_file.close()
+    except Exception as e:
+        errors.append(e)
+    blocks.put(None)
+
+
+def pipelined_ngrams(config, source_name, skip=0):
+    """ read_ngrams(), split into stages: a thread decompresses blocks of lines, a pool of config["parsers"] processes
+    splits and cleans them, and the caller gets the lines back in their original order to add up."""
+    blocks = queue.Queue(config["parsers"] * 2)
+    in_flight = threading.Semaphore(config["parsers"] * 4)     # Parsed blocks waiting for the caller. Bounds memory.
+    errors = []
+
+    def queued_blocks():
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            in_flight.acquire()
+            yield block
+
+    # The pool forks first: a child forked while the reader runs could inherit its locks (eg: the queue's) held.
+    pool = multiprocessing.get_context("fork").Pool(config["parsers"], ignore_interrupt)
+    try:
+        reader = threading.Thread(target=read_blocks, args=(source_name, config["read_bytes"], blocks, errors, skip))
+        reader.daemon = True
+        reader.start()
+        for rows in pool.imap(parse_block, queued_blocks()):
+            in_flight.release()
+            for row in rows:
+                yield row
+        if len(errors) > 0:
+            raise errors[0]
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def is_trigram(ngram):
+    """ True if the cleaned [ngram] is three words. (Cleaning can leave fewer, eg: where one was punctuation.)"""
+    words = ngram.split(" ")
+    return len(words) == 3 and "" not in words
+
+
+def process_dict(config, source_name, outpath, a, b):
+    """ Rend a single source n-gram file down to the bare bones that we need. """
+    result = {"name": a + b, "status": "skipped", "in_count": 0, "out_count": 0, "seconds": 0.0}
+    quiet = config["workers"] > 1       # Worker processes leave the talking to the main process.
+
+    # Be sure the destination folder exists
+    if not os.path.exists(outpath + "/" + a + "/"):
+        try:
+            os.makedirs(outpath + "/" + a + "/", mode=0o755)
+        except OSError:     # Someone else made it first.
+            pass
+
+    # Claim the source file by creating the "in progress" file, just in case the process gets interrupted.
+    # If it already exists skip it (probably being worked on by another process.)
+    # With -resume, an in progress file that has a checkpoint is left over from an interrupted run. Carry on from there.
+    ip_file_name = outpath + "/" + a + "/" + config["ip_file_name"] + a + b + ".txt"
+    checkpoint = None
+    try:
+        ip_file = os.open(ip_file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        os.write(ip_file, ("This file will be removed when processing this dictionary entry (" + a + b + ") is complete.").encode('utf-8'))
+        os.close(ip_file)
+    except OSError:
+        if config["resume"]:
+            checkpoint = load_checkpoint(config, outpath, a, b)
+        if checkpoint is None:
+            return result
+
+    start_time = time.time()
+    out_names = [a + b + c + ".txt" for c in config["char_list"]]
+    if config["map"]:
+        out_names.append(config["fr_file_name"] + a + b + ".txt")
+    if checkpoint is None:
+        if not quiet:
+            print ("Processing ["+a+b+"]. Started at " + time.asctime(time.localtime())+".")
+        # Create empty files to append entries to
+        for name in out_names:
+            out_file = codecs.open(outpath + "/" + a + "/" + name, 'w', 'utf-8')
+            out_file.close()
+        checkpoint = {"lines": 0, "last_pair": "", "running_total": 0, "decades": "", "pub_count": 0}
+    else:
+        if not quiet:
+            print ("Resuming ["+a+b+"] from line %i. Started at %s." % (checkpoint["lines"], time.asctime(time.localtime())))
+        # Throw away anything written after the checkpoint.
+        for name in out_names:
+            out_file = codecs.open(outpath + "/" + a + "/" + name, 'a', 'utf-8')
+            out_file.close()
+            os.truncate(outpath + "/" + a + "/" + name, checkpoint["sizes"].get(name, 0))
+
+    # Process the input file
+    if config["parsers"] > 0 and not multiprocessing.current_process().daemon:     # Pool workers can't start their own pool.
+        ngrams = pipelined_ngrams(config, source_name, checkpoint["lines"])
+    else:
+        ngrams = read_ngrams(source_name, config["read_block"], checkpoint["lines"])
+    writer = ShardWriter(outpath + "/" + a + "/", config["write_buffer"])
+    last_pair = checkpoint["last_pair"]
+    running_total = checkpoint["running_total"]
+    decade_counts = parse_decades(checkpoint["decades"])
+    pub_count = checkpoint["pub_count"]
+    in_count = checkpoint["lines"]
+    for this_pair, this_year, this_count, this_pubs in ngrams:
+        in_count += 1
+        if in_count % 100000 == 0 and not quiet:
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        if this_pair is not None:
+            if config["trigrams"] and not is_trigram(this_pair):
+                this_pair = ""      # Thrown out (when it's saved), like anything else cleaning leaves empty.
+            pub_count += this_pubs
+            if this_pair == last_pair:       # Same as the last, keep adding them up.
+                if config["decades"]:       # Keep every year, filed by decade, so the years can be picked when it's used.
+                    decade_counts[this_year // 10] = decade_counts.get(this_year // 10, 0) + this_count
+                    running_total += this_count
+                elif this_year >= config["startyear"] and this_year <= config["endyear"]:   # If the year is good, add the count
+                    running_total += this_count
+            else:   # It's a new ngram. Save the old one.
+                if last_pair == "":
+                    pass    # There wasn't one, or cleaning threw it out.
+                elif config["map"]:    # Keep everything. The thresholds are applied to the totals by -reduce.
+                    if running_total > 0:
+                        out_file_name = shard_name(last_pair)
+                        if not out_file_name.startswith(a + b):     # Not one of ours. Keep it aside so it's sorted too.
+                            out_file_name = config["fr_file_name"] + a + b
+                        writer.write(out_file_name, last_pair + "\t" + str(running_total) + "\t" + str(pub_count) + "\t" + format_decades(decade_counts) + "\n")
+                elif running_total >= config["minfreq"] and pub_count >= config["minpubs"]:   # If we have enough of them add it to the dictionary
+                    out_file_name = last_pair[0:3]
+                    out_file_name = out_file_name.ljust(3, "_")
+                    out_file_name = out_file_name.replace(" ", "_")
+                    if config["decades"]:
+                        writer.write(out_file_name, last_pair + "\t" + str(running_total) + "\t" + format_decades(decade_counts) + "\n")
+                    else:
+                        writer.write(out_file_name, last_pair + "\t" + str(running_total) + "\n")
+                last_pair = this_pair
+                running_total = 0
+                decade_counts = {}
+                pub_count = 0
+        if config["checkpoint"] > 0 and in_count % config["checkpoint"] == 0:
+            writer.flush_all()
+            sync_files(outpath + "/" + a + "/" + name for name in out_names)    # Or a crash could lose what the checkpoint counts.
+            sizes = dict((name, os.path.getsize(outpath + "/" + a + "/" + name)) for name in out_names)
+            save_checkpoint(config, outpath, a, b, {"lines": in_count, "last_pair": last_pair, "running_total": running_total,
+                                                    "decades": format_decades(decade_counts), "pub_count": pub_count, "sizes": sizes})
+    writer.close()      # Everything is on disk before it's consolidated. The in-progress file still covers it until then.
+
+    # Optimize the new files (merge duplicates)
+    if not quiet:
         sys.stdout.write("\nOptimizing...")
-        out_count = 0
-        for c in config["char_list"]:
+    out_count = 0
+    if config["map"]:
+        out_count += run_consolidate(outpath + "/" + a + "/" + config["fr_file_name"] + a + b + ".txt", config["sort_run"])
+    for c in config["char_list"]:
+        if not quiet:
             sys.stdout.write('.')
             sys.stdout.flush()
-            out_count += file_consolidate(outpath + "/" + a + "/" + a + b + c + ".txt")
+        if config["map"]:
+            out_count += run_consolidate(outpath + "/" + a + "/" + a + b + c + ".txt", config["sort_run"])
+        else:
+            out_count += file_consolidate(outpath + "/" + a + "/" + a + b + c + ".txt", config["sort_run"])
 
-        end_time = time.clock()
-        print("\nReduced [%s%s] from %i to %i in %.1f seconds at %s." % (a, b, in_count, out_count, (end_time - start_time), time.asctime(time.localtime())))
+    result["in_count"] = in_count
+    result["out_count"] = out_count
+    result["seconds"] = time.time() - start_time
+    result["status"] = "done"
 
-        # remove "in-progress" file since we're done!
-        try:
-            os.remove(ip_file_name)
-        except OSError:                         # If you want to stop the run only after the current data set is complete, remove the in-progress file.
-            print("In-progress file not found. Stopping with [%s%s] completed." % (a, b))
-            exit(0)
+    # remove "in-progress" file since we're done!
+    if os.path.isfile(checkpoint_name(config, outpath, a, b)):
+        os.remove(checkpoint_name(config, outpath, a, b))
+    try:
+        os.remove(ip_file_name)
+    except OSError:                         # If you want to stop the run only after the current data set is complete, remove the in-progress file.
+        result["status"] = "stopped"
+    return result
+
+
+def process_job(config, source_name, outpath, a, b):
+    """ Runs process_dict in a worker process, turning any failure into a result instead of a dead pool. """
+    try:
+        return process_dict(config, source_name, outpath, a, b)
+    except Exception as e:
+        remove_partial(config, outpath, a, b)
+        return {"name": a + b, "status": "failed", "error": "%s: %s" % (type(e).__name__, e)}
+
+
+def job_process(config, job, writer):
+    """ Processes one source file in its own -workers process, sending the result back through [writer]. """
+    ignore_interrupt()
+    writer.send(process_job(config, *job))
+    writer.close()
+
+
+def ignore_interrupt():
+    """ Worker processes leave ^C to the main process, which shuts the pool down and cleans up."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def show_result(result):
+    """ Reports the outcome of processing a single source file. Returns True if processing should continue."""
+    if result["status"] in ["done", "stopped"]:
+        print("Reduced [%s] from %i to %i in %.1f seconds at %s." % (result["name"], result["in_count"], result["out_count"], result["seconds"], time.asctime(time.localtime())))
+    if result["status"] == "stopped":
+        print("In-progress file not found. Stopping with [%s] completed." % result["name"])
+        return False
+    if result["status"] == "failed":
+        print("Error: Processing [%s] failed (%s). Its partial files were removed." % (result["name"], result["error"]))
+    return True
+
+
+def run_jobs(config, jobs):
+    """ Processes the source files in [jobs], [workers] at a time. Returns the results."""
+    results = []
+    if config["workers"] <= 1:
+        for job in jobs:
+            result = process_dict(config, *job)
+            if result["status"] != "skipped":
+                print("")
+            results.append(result)
+            if not show_result(result):
+                break
+        return results
+
+    print("Processing %i source files with %i workers." % (len(jobs), config["workers"]))
+    jobs = list(jobs)
+    running = {}    # The end of the pipe each worker sends its result down -> (its process, its job).
+    stopping = False
+    try:
+        # Only start as many jobs as there are workers so that stopping (or failing) doesn't leave a backlog behind.
+        while len(jobs) > 0 or len(running) > 0:
+            while len(jobs) > 0 and len(running) < config["workers"] and not stopping:
+                job = jobs.pop(0)
+                reader, writer = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=job_process, args=(config, job, writer))
+                process.daemon = True   # So it can't start a -parsers pool of its own, and dies with us.
+                process.start()
+                writer.close()
+                running[reader] = (process, job)
+            if len(running) == 0:
+                break
+            for reader in multiprocessing.connection.wait(list(running)):
+                process, job = running.pop(reader)
+                try:
+                    result = reader.recv()
+                except EOFError:    # It died without a result. (eg: killed for using too much memory.)
+                    process.join()
+                    remove_partial(config, job[1], job[2], job[3])
+                    result = {"name": job[2] + job[3], "status": "failed", "error": "its worker process died with exit code %s" % process.exitcode}
+                reader.close()
+                process.join()
+                results.append(result)
+                if result["status"] != "skipped":
+                    if not show_result(result):
+                        stopping = True
+                    print("%i of %i source files finished." % (len(results), len(results) + len(jobs) + len(running)))
+    except KeyboardInterrupt:
+        for process, job in running.values():
+            process.terminate()
+            process.join()
+        raise
+    return results
 
 
 def start_process(config):
@@ -178,7 +717,7 @@ def start_process(config):
 
     # TODO More (e.g. some) error checks on file operations.
 
-    source_files_found = 0
+    jobs = []
     # Increment through the available source files
     for a in config["char_list"][1:]:           # valid dicts don't start with underscore
         for b in config["char_list"]:
@@ -186,57 +725,98 @@ def start_process(config):
             if os.path.isfile(source_name):
                 # See if this source file has been done
                 output_name = config["outpath"] + a + "/" + a + b + "_.txt"    # (or at least the first file created)
+                ip_file_name = config["outpath"] + a + "/" + config["ip_file_name"] + a + b + ".txt"
                 if not os.path.isfile(output_name):
-                    process_dict(source_name, config["outpath"], a, b)
-                    source_files_found += 1
-    if source_files_found == 0:
+                    jobs.append((source_name, config["outpath"], a, b))
+                elif config["resume"] and os.path.isfile(ip_file_name):     # Interrupted. Pick it up again.
+                    if load_checkpoint(config, config["outpath"], a, b) is None:
+                        print("No usable checkpoint for [%s]. Starting it over." % (a + b))
+                        remove_partial(config, config["outpath"], a, b)
+                    jobs.append((source_name, config["outpath"], a, b))
+    if len(jobs) == 0:
         print("Note: No source ngram files found matching '%s%s??.gz'" % (config["inpath"], config["inbase"]))
-    else:
-        print("Processed %i source files." % (source_files_found))
-
-
-def get_config():
-    """ Parse the command line arguments and otherwise get things ready to go. """
+        return True
+    results = run_jobs(config, jobs)
+    processed = [r for r in results if r["status"] in ["done", "stopped"]]
+    failed = [r for r in results if r["status"] == "failed"]
+    print("Processed %i source files." % (len(processed)))
+    if len(failed) > 0:
+        print("Error: %i source files failed: %s" % (len(failed), ", ".join(r["name"] for r in failed)))
+        return False
+    return True
+
+
+def get_config(args=None):
+    """ Parse the command line arguments (or [args]) and otherwise get things ready to go. """
     parser = argparse.ArgumentParser(description='Reduce Google N-Gram 2-gram files from http://storage.googleapis.com/books/ngrams/books/datasetsv2.html to something much more manageable.')
     parser.add_argument('-inpath', help='Path to Google ngram v2 files. Default: (current folder)', required=False, default="", metavar="PATH")
-    parser.add_argument('-inbase', help='Base file name for incoming nagram files. Default: "googlebooks-eng-us-all-2gram-20120701-"', required=False, default="googlebooks-eng-us-all-2gram-20120701-", metavar="STRING")
+    parser.add_argument('-inbase', help='Base file name for incoming nagram files. Default: "googlebooks-eng-us-all-2gram-20120701-" ("-3gram-" with -trigrams)', required=False, default=None, metavar="STRING")
     parser.add_argument('-outpath', help='Created dictionary path. Default: dictionary/.', required=False, default="dictionary/", metavar="PATH")
     parser.add_argument('-cleanup', nargs="?", help="Flag to clean up any in-progress files in -outpath. Use after abnormal termination. Don't use when running in another process.", default=False)
     parser.add_argument('-startyear', help="Earliest year for acceptable dictionary data. Default: 1972", required=False, default=1972, type=int, metavar="YEAR")
     parser.add_argument('-endyear', help="Latest year for acceptable dictionary data. Default: 2012", required=False, default=2012, type=int, metavar="YEAR")
+    parser.add_argument('-decades', help="Keep counts for every decade instead of just -startyear to -endyear, so the years can be chosen when checking text. (Compile the result with compiledict.py.)", action="store_true")
     parser.add_argument('-minfreq', help="Minimum n-gram frequency before it's noticed. Default: 250", required=False, default=250, type=int)
     parser.add_argument('-minpubs', help="Minimum number of publications an n-gram is found in before it's noticed. Default: 2", required=False, default=2, type=int)
-
-    config = vars(parser.parse_args())
+    parser.add_argument('-workers', help="Number of source files to process at once, each in its own process. Default: 1", required=False, default=1, type=int, metavar="N")
+    parser.add_argument('-checkpoint', help="Save progress every N source lines so an interrupted file can be picked up again with -resume. 0 turns it off. Default: 1000000", required=False, default=1000000, type=int, metavar="N")
+    parser.add_argument('-resume', help="Carry on with source files an earlier run didn't finish, from their last checkpoint. (Files without one are started over.) Don't use while another copy is running in -outpath.", action="store_true")
+    parser.add_argument('-map', help="Write sorted runs to -outpath instead of a finished dictionary, keeping everything (-minfreq and -minpubs are left to -reduce.)", action="store_true")
+    parser.add_argument('-reduce', nargs="+", help="Merge the runs made by -map in these folders into a finished dictionary in -outpath, applying -minfreq and -minpubs to the combined counts.", default=None, metavar="PATH")
+    parser.add_argument('-trigrams', help="Build a 3-gram dictionary from 3-gram source files, for ingram.py -trigrams. Use its own -outpath and compile it with compiledict.py -blocks.", action="store_true")
+    parser.add_argument('-parsers', help="Split and clean each source file in N processes while another thread decompresses it. Only used with -workers 1. Default: 0 (all in one process)", required=False, default=0, type=int, metavar="N")
+
+    config = vars(parser.parse_args(args))
+    if config["inbase"] is None:
+        config["inbase"] = "googlebooks-eng-us-all-%igram-20120701-" % (3 if config["trigrams"] else 2)
 
     #Add some useful info to the config.
     config["char_list"] = "_abcdefghijklmnopqrstuvwxyz"  # Characters used to iterate through the file names.
     config["ip_file_name"] = "_currently_woring_on_"     # Base name of the file created to show the world what's in progress. Used for resuming.
+    config["cp_file_name"] = "_checkpoint_"              # Base name of the file recording how far an in-progress file has got.
+    config["fr_file_name"] = "_foreign_"                 # -map: entries from a source file that belong in someone else's dictionary files.
+    config["read_block"] = 10000                         # Source lines read and cleaned at a time.
+    config["read_bytes"] = 1024 * 1024                   # Decompressed bytes read at a time with -parsers.
+    config["sort_run"] = 500000                          # Entries sorted in memory at a time while consolidating. Bigger runs spill to disk.
+    config["write_buffer"] = 1024 * 1024                 # Characters of output held in memory per dictionary file before it's written out.
 
     return config
 
-config = get_config()
+if __name__ == "__main__":
+    config = get_config()
+
+    # basic validation of the command line input.
+    if config["startyear"] > config["endyear"] or config["startyear"] > 2012:
+        print("Check your date range for dates that actually exist.")
+        exit(1)
 
-# basic validation of the command line input.
-if config["startyear"] > config["endyear"] or config["startyear"] > 2012:
-    print("Check your date range for dates that actually exist.")
-    exit(1)
+    if config["inpath"] != "":
+        if not os.path.exists(config["inpath"]):
+            print("Input path '"+config["inpath"]+"' not found.")
+            exit(1)
 
-if config["inpath"] != "":
-    if not os.path.exists(config["inpath"]):
-        print("Input path '"+config["inpath"]+"' not found.")
+    if config["map"] and config["reduce"] is not None:
+        print("Use -map and -reduce separately.")
         exit(1)
 
-if config["cleanup"] is not False:
-    if os.path.exists(config["outpath"]):
-        cleanup(config)
+    if config["reduce"] is not None:
+        try:
+            if not start_reduce(config):
+                exit(1)
+        except KeyboardInterrupt:
+            print("Canceling!")
+            exit(1)
+    elif config["cleanup"] is not False:
+        if os.path.exists(config["outpath"]):
+            cleanup(config)
+        else:
+            print("Can't find the output path '" + config["outpath"] + "' to clean up.")
+            exit(1)
     else:
-        print("Can't find the output path '" + config["outpath"] + "' to clean up.")
-        exit(1)
-else:
-    try:
-        start_process(config)
-    except KeyboardInterrupt:  # Let a ^C exit without having to call -cleanup afterward.
-        clean_exit(config)
+        try:
+            if not start_process(config):
+                exit(1)
+        except KeyboardInterrupt:  # Let a ^C exit without having to call -cleanup afterward.
+            clean_exit(config)
 
-print("Complete!")
+    print("Complete!")
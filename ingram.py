@@ -1,84 +1,342 @@
 """A proofreading tool using Google's N-gram corpus."""
 
 import argparse
+import asyncio
 from cleanstring import *
+from collections import namedtuple, OrderedDict
 import codecs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cProfile
+from compiledict import open_compiled, open_filter, shard_name
 import csv
+import difflib
+from functools import partial
+import glob
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import json
+import multiprocessing
 import os
+import pstats
+import re
 import sys
+import time
+from urllib.request import Request, urlopen
 
 
-def find_frequency(dictionary_location, s):
-    """Reports the raw frequency of the two word string [s] in the specified dictionary location."""
+SIDECAR_EXTENSION = ".ingram"      # Added to a document's name to save its reports for -incremental.
+STREAM_CHUNK = 2000                 # Tokens passed between -stream's stages at a time.
+STREAM_QUEUE = 4                    # Chunks allowed to wait between two stages. (Bounds -stream's memory.)
+TOKEN_CHUNK = 65536                 # Characters of input tokenized in one go.
+
+# A token runs to the next space or the end of its line. It's a word if it has a letter strip_word() would keep.
+# (Only A-Z, and the two characters that lowercase to one, do.)
+# Each match is (spaces before it, word, fragment).
+TOKEN_PATTERN = re.compile("( *)(?:([^ \n]*[A-Za-z\u0130\u212a][^ \n]*\n?)|([^ \n]+\n?|\n))")
+SKIPPED_FRAGMENTS = frozenset(["\t", "\n", "\r"])
+CLOSING_PUNCTUATION = " \t\r\n\"')]\u2019\u201d"
+SENTENCE_ENDS = frozenset(".!?\u2026")
+
+
+class Token(namedtuple("Token", ["is_word", "text", "offset"])):
+    """A piece of the input text: a word, with any punctuation attached to it, or a fragment (usually punctuation.)
+    [offset] is where it starts, counting characters from the start of the input."""
+    __slots__ = ()
+
+    @property
+    def sentence_end(self):
+        """ True if the token ends in . ! ? or ... (before any closing quotes or brackets.)"""
+        return self.text.rstrip(CLOSING_PUNCTUATION)[-1:] in SENTENCE_ENDS
+
+
+make_token = partial(tuple.__new__, Token)     # Skips Token's argument handling, which costs more than the tokenizing.
+
+
+# The familiarity rating of a single word. [index] counts words from 0, [fragment] is any punctuation that followed it,
+# [offset] is where the word starts in the text, in characters, and [frequency_trigram] is the frequency of the word
+# with both neighbors. (Only looked up with -trigrams.)
+Report = namedtuple("Report", ["index", "word", "fragment", "score", "frequency_before", "frequency_after", "offset", "frequency_trigram"], defaults=(None, None))
+make_report = partial(tuple.__new__, Report)   # Like make_token, for the many Reports -incremental reuses.
+
+
+class Stats(object):
+    """Counts and times what the hot paths are doing, for -stats."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.lookups = 0            # find_frequency calls
+        self.hits = 0
+        self.misses = 0
+        self.uncovered = 0          # No dictionary file for the pair (or it's an edge word.)
+        self.prefetched = 0         # Answered from batch mode's resolved pairs.
+        self.filtered = 0           # Ruled out by the Bloom filter without a lookup.
+        self.trigram_lookups = 0    # find_trigram_frequency calls
+        self.trigram_misses = 0
+        self.shards_opened = 0      # Text dictionary files read
+        self.lines_scanned = 0
+        self.whitelist_checks = 0
+        self.reports = 0
+        self.reused = 0             # Reports carried over from the last run by -incremental.
+        self.writes = 0
+        self.times = {"lookup": 0.0, "batch_lookup": 0.0, "trigram_lookup": 0.0, "whitelist": 0.0, "report": 0.0, "output": 0.0}
+        self.cache = None
+
+    def add_lookup(self, frequency, seconds):
+        self.lookups += 1
+        self.times["lookup"] += seconds
+        if frequency is None:
+            self.uncovered += 1
+        elif frequency > 0:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def as_dict(self):
+        """Everything counted so far. Times are in seconds."""
+        stats = {"seconds": time.time() - self.started, "lookups": self.lookups, "hits": self.hits, "misses": self.misses,
+                 "uncovered": self.uncovered, "prefetched": self.prefetched, "filtered": self.filtered, "trigram_lookups": self.trigram_lookups,
+                 "trigram_misses": self.trigram_misses, "shards_opened": self.shards_opened,
+                 "lines_scanned": self.lines_scanned, "whitelist_checks": self.whitelist_checks, "reports": self.reports, "reused": self.reused,
+                 "writes": self.writes, "times": dict(self.times)}
+        # Scoring time includes the lookups and whitelist checks made while scoring. Show what's left.
+        stats["times"]["scoring"] = max(self.times["report"] - self.times["lookup"] - self.times["trigram_lookup"] - self.times["whitelist"], 0.0)
+        if self.cache is not None:
+            stats["cache"] = {"hits": self.cache.hits, "misses": self.cache.misses, "shards": len(self.cache.shards), "bytes": self.cache.size}
+        return stats
+
+    def summary(self):
+        """A human readable version of as_dict()."""
+        stats = self.as_dict()
+        lines = ["Ingram stats (%.2f seconds):" % stats["seconds"]]
+        lines.append("  Words reported: %i (%.1f per second), %i reused from the last run" % (stats["reports"], stats["reports"] / max(stats["seconds"], 0.000001), stats["reused"]))
+        lines.append("  Lookups: %i (%i hits, %i misses, %i not covered, %i from batches, %i ruled out by the filter)" % (stats["lookups"], stats["hits"], stats["misses"], stats["uncovered"], stats["prefetched"], stats["filtered"]))
+        if stats["trigram_lookups"] > 0:
+            lines.append("  Trigram lookups: %i (%i missing) in %.3fs" % (stats["trigram_lookups"], stats["trigram_misses"], stats["times"]["trigram_lookup"]))
+        lines.append("  Dictionary files read: %i, lines scanned: %i (%.1f per lookup)" % (stats["shards_opened"], stats["lines_scanned"], stats["lines_scanned"] / float(max(stats["lookups"], 1))))
+        if "cache" in stats:
+            lines.append("  Shard cache: %i hits, %i misses, %i shards (%.1f MB) resident" % (stats["cache"]["hits"], stats["cache"]["misses"], stats["cache"]["shards"], stats["cache"]["bytes"] / (1024.0 * 1024.0)))
+        lines.append("  Whitelist checks: %i, output writes: %i" % (stats["whitelist_checks"], stats["writes"]))
+        times = stats["times"]
+        lines.append("  Time: lookups %.3fs, batch lookups %.3fs, whitelist %.3fs, other scoring %.3fs, output %.3fs" % (times["lookup"], times["batch_lookup"], times["whitelist"], times["scoring"], times["output"]))
+        return "\n".join(lines) + "\n"
+
+
+class ShardCache(object):
+    """Keeps recently used text shards in memory as dicts, evicting the least recently used past a memory budget."""
+
+    def __init__(self, budget_mb, counters=None):
+        self.counters = counters
+        self.budget = budget_mb * 1024 * 1024
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.shards = OrderedDict()     # file name -> (shard dict, estimated size in bytes)
+
+    def get(self, file_name):
+        """Returns the parsed shard for [file_name], reading it in if it isn't already cached."""
+        if file_name in self.shards:
+            self.hits += 1
+            self.shards.move_to_end(file_name)
+            return self.shards[file_name][0]
+        self.misses += 1
+        shard = {}
+        size = sys.getsizeof(shard)
+        scanned = 0
+        in_file = codecs.open(file_name, 'r', 'utf-8')
+        for data_in in in_file:
+            scanned += 1
+            data_list = data_in.split("\t")
+            if data_list[0] not in shard and len(data_list) > 1:     # Keep the first match, as a linear scan would.
+                shard[data_list[0]] = int(data_list[1])
+                size += sys.getsizeof(data_list[0]) + 100    # Rough cost of the key, the int and the hash table slot.
+        in_file.close()
+        if self.counters is not None:
+            self.counters.shards_opened += 1
+            self.counters.lines_scanned += scanned
+        if size <= self.budget:
+            self.shards[file_name] = (shard, size)
+            self.size += size
+            while self.size > self.budget:
+                evicted = self.shards.popitem(last=False)
+                self.size -= evicted[1][1]
+        return shard
+
+
+def shard_file(config, s):
+    """Returns the text file the cleaned ngram [s] is filed under, or None if its letter folder doesn't exist."""
+    path = config["dict"] + s[0]
+    if os.path.exists(path):
+        return path + "/" + shard_name(s) + ".txt"
+    return None
+
+
+def find_frequency(config, s):
+    """Reports the raw frequency of the two word string [s] in the configured dictionary."""
+    counters = config["counters"]
+    if counters is not None:
+        started = time.perf_counter()
     frequency = 0
     s = clean_string(s)
     if s == "":
-        return None
+        frequency = None
+    elif s in config["resolved"]:
+        frequency = config["resolved"][s]
+        if counters is not None:
+            counters.prefetched += 1
+    elif config["filter"] is not None and not config["filter"].might_contain(s):
+        if counters is not None:
+            counters.filtered += 1
+    elif config["compiled_dict"] is not None:
+        frequency = config["compiled_dict"].frequency(s, config["years"])
     else:
         # See if the appropriate dictionary exists
-        path = dictionary_location + s[0]
-        if os.path.exists(path):
-            file_name = path + "/" + s[0]
-            if len(s) < 2 or s[1] == " ":
-                file_name += "_"
-            else:
-                file_name += s[1]
-            if len(s) < 3 or s[2] == " ":
-                file_name += "_"
-            else:
-                file_name += s[2]
-            file_name += ".txt"
-            if os.path.isfile(file_name):
+        file_name = shard_file(config, s)
+        if file_name is not None:
+            if config["shard_cache"] is not None and os.path.isfile(file_name):
+                frequency = config["shard_cache"].get(file_name).get(s, 0)
+            elif os.path.isfile(file_name):
                 # Read through the dictionary until we find a match (or not.)
+                scanned = 0
                 in_file = codecs.open(file_name, 'r', 'utf-8')
                 for data_in in in_file:
+                    scanned += 1
                     data_list = data_in.split("\t")
                     if data_list[0] == s:
                         frequency = int(data_list[1])
                         break
                 in_file.close()
+                if counters is not None:
+                    counters.shards_opened += 1
+                    counters.lines_scanned += scanned
             else:
                 frequency = None    # No dictionary found for this guy.
+    if counters is not None:
+        counters.add_lookup(frequency, time.perf_counter() - started)
+    return frequency
+
+
+def find_trigram_frequency(config, s):
+    """Reports the raw frequency of the three word string [s] in the -trigrams dictionary."""
+    counters = config["counters"]
+    if counters is not None:
+        started = time.perf_counter()
+    frequency = 0
+    s = clean_string(s)
+    if s == "":
+        frequency = None
+    elif config["trigram_filter"] is None or config["trigram_filter"].might_contain(s):
+        frequency = config["trigram_dict"].frequency(s, config["years"])
+    if counters is not None:
+        counters.trigram_lookups += 1
+        if frequency == 0:
+            counters.trigram_misses += 1
+        counters.times["trigram_lookup"] += time.perf_counter() - started
     return frequency
 
 
+def resolve_bigrams(config, pairs):
+    """Looks up a batch of two word strings, reading each dictionary file at most once. Returns {cleaned ngram: frequency}."""
+    resolved = {}
+    wanted = {}     # file name -> set of cleaned ngrams to find in it
+    for pair in pairs:
+        s = clean_string(pair)
+        if s == "" or s in resolved:
+            continue
+        if config["filter"] is not None and not config["filter"].might_contain(s):
+            resolved[s] = 0
+            if config["counters"] is not None:
+                config["counters"].filtered += 1
+        elif config["compiled_dict"] is not None:
+            resolved[s] = config["compiled_dict"].frequency(s, config["years"])
+        else:
+            file_name = shard_file(config, s)
+            if file_name is None:
+                resolved[s] = 0
+            elif file_name in wanted:
+                wanted[file_name].add(s)
+            elif os.path.isfile(file_name):
+                wanted[file_name] = set([s])
+            else:
+                resolved[s] = None    # No dictionary found for this guy.
+
+    for file_name in sorted(wanted):
+        ngrams = wanted[file_name]
+        if config["shard_cache"] is not None:
+            shard = config["shard_cache"].get(file_name)
+            for s in ngrams:
+                resolved[s] = shard.get(s, 0)
+            continue
+        # One pass through the file picks up everything we're looking for.
+        remaining = set(ngrams)
+        scanned = 0
+        in_file = codecs.open(file_name, 'r', 'utf-8')
+        for data_in in in_file:
+            scanned += 1
+            data_list = data_in.split("\t")
+            if data_list[0] in remaining:
+                resolved[data_list[0]] = int(data_list[1])
+                remaining.remove(data_list[0])
+                if len(remaining) == 0:
+                    break
+        in_file.close()
+        if config["counters"] is not None:
+            config["counters"].shards_opened += 1
+            config["counters"].lines_scanned += scanned
+        for s in remaining:
+            resolved[s] = 0
+    return resolved
+
+
 def whitelisted(config, word):
     """Report True if the word is in the whitelist or should otherwise be given a passing grade."""
-    for char in word:
-        ascii = ord(char)
-        if ascii >= 48 and ascii <= 57:
-            return True      # Numbers get a free pass
-    word = strip_word(word)
-    if word in config["custom_dict"]:
-        return True
-    return False
+    counters = config["counters"]
+    if counters is not None:
+        started = time.perf_counter()
+    result = False
+    if has_digits(word):
+        result = True      # Numbers get a free pass
+    elif strip_word(word) in config["custom_dict"]:
+        result = True
+    if counters is not None:
+        counters.whitelist_checks += 1
+        counters.times["whitelist"] += time.perf_counter() - started
+    return result
 
 
-def report_familiarity(config, word_trio, previous_report={}):
+def report_familiarity(config, word_trio, previous_report=None, index=0, fragment="", offset=None):
     """Takes a three word list and returns the familiarity rating for the one in the middle."""
     edge_frequency = config["maxfreq"] * 0.7       # How much artificial frequency is added to edge words. (Very first and last words.)
-    report = {"word": word_trio[1]}
+    counters = config["counters"]
+    if counters is not None:
+        started = time.perf_counter()
 
     if whitelisted(config, word_trio[1]):
-        report["frequency_before"] = config["maxfreq"]
-        report["frequency_after"] = config["maxfreq"]
-        report["score"] = 100
-        return report
+        if counters is not None:
+            counters.reports += 1
+            counters.times["report"] += time.perf_counter() - started
+        return Report(index, word_trio[1], fragment, 100, config["maxfreq"], config["maxfreq"], offset)
 
-    if whitelisted(config, word_trio[0]):
-            report["frequency_before"] = config["maxfreq"]
+    before_listed = whitelisted(config, word_trio[0])
+    if before_listed:
+        report_before = config["maxfreq"]
+    elif previous_report is not None and type(previous_report.frequency_after) == int:
+        report_before = previous_report.frequency_after
     else:
-        if "frequency_after" in previous_report and type(previous_report["frequency_after"]) == int:
-            report["frequency_before"] = previous_report["frequency_after"]
-        else:
-            report["frequency_before"] = find_frequency(config["dict"], word_trio[0]+" "+word_trio[1])
-    frequency_before = report["frequency_before"]
+        report_before = find_frequency(config, word_trio[0]+" "+word_trio[1])
+    frequency_before = report_before
 
-    if whitelisted(config, word_trio[2]):
-        report["frequency_after"] = config["maxfreq"]
+    after_listed = whitelisted(config, word_trio[2])
+    if after_listed:
+        report_after = config["maxfreq"]
     else:
-        report["frequency_after"] = find_frequency(config["dict"], word_trio[1]+" "+word_trio[2])
-    frequency_after = report["frequency_after"]
+        report_after = find_frequency(config, word_trio[1]+" "+word_trio[2])
+    frequency_after = report_after
+
+    # Both pairs can be familiar when the three words together aren't. (eg: "drank the bear")
+    report_trigram = None
+    if config["trigram_dict"] is not None and report_before and report_after and not before_listed and not after_listed:
+        report_trigram = find_trigram_frequency(config, word_trio[0]+" "+word_trio[1]+" "+word_trio[2])
 
     if frequency_before is None and frequency_after is None:
         frequency_before = 0
@@ -92,120 +350,651 @@ def report_familiarity(config, word_trio, previous_report={}):
         frequency_before = config["maxfreq"]
     if frequency_after > config["maxfreq"]:
         frequency_after = config["maxfreq"]
-    report["score"] = frequency_before + frequency_after
+    score = frequency_before + frequency_after
     if frequency_before == 0 or frequency_after == 0:
-        report["score"] -= report["score"] * (config["missinghit"]/100)
+        score -= score * (config["missinghit"]/100)
+    elif report_trigram == 0:
+        score -= score * (config["missingtrigram"]/100)
 
     # Normalize the number 0-100
-    report["score"] = int(((report["score"] / 200) * 100)/(config["maxfreq"]/100))
-    return report
-
-
-def start_report(config):
-    """ Does the housekeeping necessary before saving/displaying the report."""
-    out_string = ""
-    if config["out"] is not None:            # Remove any existing file if we're saving one.
-        if os.path.isfile(config["out"]):
-            os.remove(config["out"])
-    if config["type"] == "full_html":
-        out_string = """<!doctype html>\n<html lang="en">\n<head>\n\t<meta charset="utf-8">\n\t<title>"""
-        out_string += config["in"]
-        out_string += """</title>\n\t<meta name="description" content="Ingram processed text.">\n\t<meta name="author" content="Ingram">\n\t<link rel="stylesheet" href="ingram.css">\n</head>\n<body>\n<p>"""
-
-    if config["out"] is not None:
-        out_file = codecs.open(config["out"], 'a', 'utf-8')
-        out_file.write(out_string)
-        out_file.close()
+    score = int(((score / 200) * 100)/(config["maxfreq"]/100))
+    if counters is not None:
+        counters.reports += 1
+        counters.times["report"] += time.perf_counter() - started
+    return Report(index, word_trio[1], fragment, score, report_before, report_after, offset, report_trigram)
 
 
-def end_report(config):
-    """ Does the housekeeping necessary after saving/displaying the report."""
-    out_string = ""
-    if config["type"] == "full_html":
-        out_string = "\n\t</p>\n</body>\n</html>\n"
+class ReportWriter(object):
+    """Writes reports to the output file (or stdout) in the requested format. The output is opened once
+    and written in blocks. When reading from stdin it's flushed at the end of every input line instead."""
 
-    if config["out"] is not None:
-        out_file = codecs.open(config["out"], 'a', 'utf-8')
-        out_file.write(out_string)
-        out_file.close()
+    def __init__(self, config, buffer_size=65536):
+        self.type = config["type"]
+        self.title = config["in"]
+        if config["out"] is not None:
+            self.out_file = codecs.open(config["out"], 'w', 'utf-8')     # Overwrites any existing file.
+        else:
+            self.out_file = sys.stdout
+        self.line_flush = config["in"] == "-"
+        self.counters = config.get("counters")      # -remote has no Checker, so no counters.
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.size = 0
+        self.csv = csv.writer(self, dialect='excel')     # CSV writer does its own wacky thing, but writes through us.
 
+    def write(self, out_string):
+        """ Queues raw output, writing it out once there's enough of it."""
+        self.pending.append(out_string)
+        self.size += len(out_string)
+        if self.size >= self.buffer_size:
+            self.flush()
 
-def show_report(config, report, fragment=""):
-    """ Display/save a line of data in the requested output format. """
-    if fragment != "":
-        fragment = " " + fragment
-    if config["type"] == "text":
-        if "score" in report:
-            out_string = report["word"] + fragment + "\t" + str(report["score"]) + "\n"
-        else:
-            out_string = report["word"] + fragment + "\t\n"
-    elif config["type"] in ["html", "full_html"]:
-        if "score" in report:
-            class_number = round((report["score"]+9) / 10) * 10
-            if config["type"] == "full_html":
-                out_string = '<span class="ngram%i ngramPopup">%s%s<span>Score:&nbsp;%i<br>Frequency&nbsp;before:&nbsp;%s<br>Frequency&nbsp;after:&nbsp;%s</span></span> ' % (class_number, report["word"], fragment, report["score"], report["frequency_before"], report["frequency_after"])
+    def flush(self):
+        if len(self.pending) > 0:
+            if self.counters is not None:
+                self.counters.writes += 1
+            self.out_file.write("".join(self.pending))
+            self.pending = []
+            self.size = 0
+        self.out_file.flush()
+
+    def start(self):
+        """ Does the housekeeping necessary before saving/displaying the report."""
+        if self.type == "full_html":
+            out_string = """<!doctype html>\n<html lang="en">\n<head>\n\t<meta charset="utf-8">\n\t<title>"""
+            out_string += self.title
+            out_string += """</title>\n\t<meta name="description" content="Ingram processed text.">\n\t<meta name="author" content="Ingram">\n\t<link rel="stylesheet" href="ingram.css">\n</head>\n<body>\n<p>"""
+            self.write(out_string)
+
+    def end(self):
+        """ Does the housekeeping necessary after saving/displaying the report, and closes the output."""
+        if self.type == "full_html":
+            self.write("\n\t</p>\n</body>\n</html>\n")
+        self.flush()
+        if self.out_file is not sys.stdout:
+            self.out_file.close()
+
+    def show(self, report):
+        """ Display/save a line of data in the requested output format. """
+        if self.counters is not None:
+            started = time.perf_counter()
+        fragment = report.fragment
+        if fragment != "":
+            fragment = " " + fragment
+        if self.type == "text":
+            if report.score is not None:
+                self.write(report.word + fragment + "\t" + str(report.score) + "\n")
+            else:
+                self.write(report.word + fragment + "\t\n")
+        elif self.type in ["html", "full_html"]:
+            if report.score is not None:
+                class_number = round((report.score+9) / 10) * 10
+                if self.type == "full_html":
+                    trigram = ""
+                    if report.frequency_trigram is not None:
+                        trigram = "<br>Trigram&nbsp;frequency:&nbsp;%s" % report.frequency_trigram
+                    out_string = '<span class="ngram%i ngramPopup">%s%s<span>Score:&nbsp;%i<br>Frequency&nbsp;before:&nbsp;%s<br>Frequency&nbsp;after:&nbsp;%s%s</span></span> ' % (class_number, report.word, fragment, report.score, report.frequency_before, report.frequency_after, trigram)
+                else:
+                    out_string = '<span class="ngram%i">%s</span>%s ' % (class_number, report.word, fragment)
             else:
-                out_string = '<span class="ngram%i">%s</span>%s ' % (class_number, report["word"], fragment)
+                out_string = report.word + " "
+            if "\n" in report.word:
+                out_string += "</p>\n<p>"
+            self.write(out_string)
+        elif self.type == "tsv":
+            self.write(str(report.index) + "\t" + report.word + fragment + "\t" + str(report.score) + "\t" + str(report.frequency_before) + "\t" + str(report.frequency_after) + "\n")
+        elif self.type == "csv":
+            self.csv.writerow([report.index, report.word + fragment, report.score, report.frequency_before, report.frequency_after])
+        if self.line_flush and "\n" in report.word:
+            self.flush()
+        if self.counters is not None:
+            self.counters.times["output"] += time.perf_counter() - started
+
+
+def read_tokens(in_file, offset=0, chunk_size=TOKEN_CHUNK):
+    """ Splits the input (lines of text) into words and fragments (usually punctuation). Yields a Token for each.
+    [offset] is where the input starts. Lines are joined into chunks of about [chunk_size] characters and each
+    chunk is scanned in one go."""
+    lines = []
+    size = 0
+    for data_in in in_file:
+        lines.append(data_in)
+        size += len(data_in)
+        # Tokens stop at the end of a line, so only lines ending in "\n" can run into the next one in a chunk.
+        if size >= chunk_size or data_in[-1:] != "\n":
+            for token in scan_tokens("".join(lines), offset):
+                yield token
+            offset += size
+            lines = []
+            size = 0
+    if len(lines) > 0:
+        for token in scan_tokens("".join(lines), offset):
+            yield token
+
+
+def scan_tokens(chunk, offset):
+    """ Returns the Tokens in [chunk], which starts [offset] characters into the input."""
+    tokens = []
+    for spaces, word, fragment in TOKEN_PATTERN.findall(chunk):
+        offset += len(spaces)
+        if word:
+            tokens.append((True, word, offset))
+            offset += len(word)
         else:
-            out_string = report["word"] + " "
-        if "\n" in report["word"]:
-            out_string += "</p>\n<p>"
-    elif config["type"] == "tsv":
-        out_string = str(config["word_count"]) + "\t" + report["word"] + fragment + "\t" + str(report["score"]) + "\t" + str(report["frequency_before"]) + "\t" + str(report["frequency_after"]) + "\n"
+            if fragment not in SKIPPED_FRAGMENTS:   # There's a fragment of something (probably punctuation) save for later.
+                tokens.append((False, fragment, offset))
+            offset += len(fragment)
+    return map(make_token, tokens)
 
-    if config["type"] == "csv":   # CSV writer does its own wacky thing.
-        if config["out"] is not None:
-            out_file = codecs.open(config["out"], 'a', 'utf-8')
-            output = csv.writer(out_file, dialect='excel')
-            output.writerow([config["word_count"], report["word"], report["score"], report["frequency_before"], report["frequency_after"]])
-            out_file.close()
+
+def batch_tokens(config, tokens):
+    """ Passes tokens through in chunks of config["batch"] words, resolving each chunk's word pairs in one go first."""
+    chunk = []
+    word_count = 0
+    last_word = ""
+    for token in tokens:
+        chunk.append(token)
+        if token[0]:
+            word_count += 1
+            if word_count >= config["batch"]:
+                last_word = resolve_chunk(config, chunk, last_word)
+                for chunk_token in chunk:
+                    yield chunk_token
+                chunk = []
+                word_count = 0
+    if len(chunk) > 0:
+        resolve_chunk(config, chunk, last_word)
+        for chunk_token in chunk:
+            yield chunk_token
+
+
+def resolve_chunk(config, chunk, last_word):
+    """ Resolves every word pair in [chunk] that report_familiarity will ask for. Returns the chunk's last word."""
+    pairs = set()
+    for token in chunk:
+        if token[0]:
+            word = token[1]
+            if last_word != "" and not whitelisted(config, last_word) and not whitelisted(config, word):
+                pairs.add(last_word + " " + word)
+            last_word = word
+    if config["counters"] is not None:
+        started = time.perf_counter()
+    config["resolved"] = resolve_bigrams(config, pairs)
+    if config["counters"] is not None:
+        config["counters"].times["batch_lookup"] += time.perf_counter() - started
+    return last_word
+
+
+class WordContexts(object):
+    """ Turns tokens into word contexts (see word_contexts()) for input that arrives a piece at a time."""
+
+    def __init__(self):
+        # The last three words, shifted along as words arrive (never more than three), and where the last two start.
+        self.word_trio = ("", "", "")
+        self.offsets = (None, None)
+        self.fragment = ""
+
+    def feed(self, tokens):
+        """ Yields (context, offset) for every word that's complete now that [tokens] have been seen."""
+        word_trio, offsets, fragment = self.word_trio, self.offsets, self.fragment
+        try:
+            for is_word, text, offset in tokens:
+                if is_word:
+                    word_trio = (word_trio[1], word_trio[2], text)
+                    offsets = (offsets[1], offset)
+                    if word_trio[1] != "":
+                        yield ((word_trio, fragment), offsets[0])
+                        fragment = ""
+                else:
+                    # A fragment (probably punctuation) goes with the word before it.
+                    fragment = text
+        finally:
+            self.word_trio, self.offsets, self.fragment = word_trio, offsets, fragment
+
+    def finish(self):
+        """ (context, offset) for the last word in the text."""
+        self.word_trio = (self.word_trio[1], self.word_trio[2], "")
+        self.offsets = (self.offsets[1], None)
+        return ((self.word_trio, ""), self.offsets[0])
+
+
+def word_contexts(tokens):
+    """ Yields (((word before, word, word after), fragment), offset) for each word from [tokens]. The context is
+    everything its Report depends on apart from its index and [offset], where it starts in the text. [fragment] is
+    any punctuation that followed the word."""
+    contexts = WordContexts()
+    for context in contexts.feed(tokens):
+        yield context
+    yield contexts.finish()
+
+
+def score_context(config, context, last_report, index, offset=None):
+    """ Rates one word from word_contexts(). [last_report] is the Report for the word before it, if there was one."""
+    word_trio, fragment = context
+    if fragment != "" or word_trio[2] == "":
+        last_report = None      # Only reuse the word before's lookup when nothing came between them.
+    return report_familiarity(config, word_trio, last_report, index, fragment, offset)
+
+
+def score_tokens(config, tokens):
+    """ Rates each word from [tokens] in the context of its neighbors. Yields a Report for each word."""
+    last_report = None
+    for index, (context, offset) in enumerate(word_contexts(tokens)):
+        last_report = score_context(config, context, last_report, index, offset)
+        yield last_report
+
+
+def rescore_contexts(config, contexts, offsets, previous):
+    """ Rates each of [contexts] (starting at [offsets]), reusing the rating of any word whose context is unchanged
+    from [previous], a (contexts, ratings) pair from load_sidecar(). Only words touching an edit are looked up again."""
+    if previous is None:
+        previous = ([], [])
+    old_contexts, old_ratings = previous
+    counters = config["counters"]
+
+    # Most edits leave the start and end of the text alone, so only what's between them is diffed.
+    head = 0
+    while head < len(contexts) and head < len(old_contexts) and contexts[head] == old_contexts[head]:
+        head += 1
+    tail = 0
+    while tail < len(contexts) - head and tail < len(old_contexts) - head and contexts[-tail - 1] == old_contexts[-tail - 1]:
+        tail += 1
+    matcher = difflib.SequenceMatcher(None, old_contexts[head:len(old_contexts) - tail], contexts[head:len(contexts) - tail], autojunk=False)
+    opcodes = [("equal", 0, head, 0, head)]
+    opcodes.extend((tag, old_start + head, old_end + head, start + head, end + head) for tag, old_start, old_end, start, end in matcher.get_opcodes())
+    opcodes.append(("equal", len(old_contexts) - tail, len(old_contexts), len(contexts) - tail, len(contexts)))
+
+    last_report = None
+    for tag, old_start, old_end, start, end in opcodes:
+        for index in range(start, end):
+            if tag == "equal":
+                word, fragment, score, frequency_before, frequency_after, frequency_trigram = old_ratings[old_start + index - start]
+                last_report = make_report((index, word, fragment, score, frequency_before, frequency_after, offsets[index], frequency_trigram))
+                if counters is not None:
+                    counters.reused += 1
+            else:
+                last_report = score_context(config, contexts[index], last_report, index, offsets[index])
+            yield last_report
+
+
+def sidecar_settings(config):
+    """ Everything besides the text that decides the reports, so a sidecar made with anything different is ignored."""
+    compiled_name = config["dict"] + "compiled.bin"
+    settings = {"dict": os.path.abspath(config["dict"]), "maxfreq": config["maxfreq"], "missinghit": config["missinghit"],
+                "years": config["years"], "whitelist": sorted(config["custom_dict"]),
+                "compiled": os.path.getmtime(compiled_name) if os.path.isfile(compiled_name) else None}
+    if config["trigram_dict"] is not None:
+        settings["trigrams"] = os.path.abspath(config["trigrams"])
+        settings["trigrams_compiled"] = os.path.getmtime(config["trigrams"] + "compiled.bin")
+        settings["missingtrigram"] = config["missingtrigram"]
+    return settings
+
+
+def load_sidecar(config, file_name):
+    """ Reads the words saved by save_sidecar(). Returns their (contexts, ratings), the ratings being (word, fragment,
+    score, frequency_before, frequency_after, frequency_trigram) tuples, or None if there aren't any usable ones."""
+    if not os.path.isfile(file_name):
+        return None
+    try:
+        in_file = io.open(file_name, 'r', encoding='utf-8')
+        try:
+            saved = json.loads(in_file.read())
+        finally:
+            in_file.close()
+        if saved["settings"] != json.loads(json.dumps(sidecar_settings(config))):
+            return None
+        ratings = [tuple(rating) for rating in saved["words"]]
+        if any(len(rating) != 6 for rating in ratings):
+            return None     # From another version.
+        words = [""] + [rating[0] for rating in ratings] + [""]
+        contexts = [((words[index], rating[0], words[index + 2]), rating[1]) for index, rating in enumerate(ratings)]
+    except (ValueError, KeyError, TypeError, IndexError):
+        return None     # Damaged or from another version. Start over.
+    return (contexts, ratings)
+
+
+def save_sidecar(config, file_name, reports):
+    """ Saves a document's reports for the next incremental check. A word's context is just its neighbors and the
+    fragment after it, so only each word and its rating are saved."""
+    ratings = [(report.word, report.fragment, report.score, report.frequency_before, report.frequency_after, report.frequency_trigram) for report in reports]
+    out_file = io.open(file_name + ".tmp", 'w', encoding='utf-8')
+    out_file.write(json.dumps({"settings": sidecar_settings(config), "words": ratings}, separators=(",", ":")))
+    out_file.close()
+    os.replace(file_name + ".tmp", file_name)
+
+
+def score_chunk(config, tokens, contexts, last_report, index, last_word):
+    """ Rates [contexts], (context, offset) pairs, in order, the first one being word number [index]. [tokens] are the
+    ones they came from and [last_word] the word before them, for batch mode. Returns their Reports."""
+    if config["batch"] > 0:
+        resolve_chunk(config, tokens, last_word)
+    reports = []
+    for context, offset in contexts:
+        last_report = score_context(config, context, last_report, index, offset)
+        reports.append(last_report)
+        index += 1
+    return reports
+
+
+async def pipeline_reports(config, lines, chunk_size=STREAM_CHUNK, queue_size=STREAM_QUEUE):
+    """ Yields a Report for each word in [lines], an async iterable of lines (str or utf-8 bytes, eg: an
+    asyncio.StreamReader.) Tokenizing, looking up and whatever the caller does with the Reports run as separate
+    stages joined by bounded queues, so reading and writing carry on while words are looked up (in a thread)."""
+    loop = asyncio.get_running_loop()
+    lookups = ThreadPoolExecutor(max_workers=1)     # One at a time. The lookups share config.
+    token_queue = asyncio.Queue(queue_size)
+    report_queue = asyncio.Queue(queue_size)
+
+    async def tokenize():
+        try:
+            chunk = []
+            offset = 0
+            async for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                chunk.extend(read_tokens([line], offset))
+                offset += len(line)
+                if len(chunk) >= chunk_size:
+                    await token_queue.put(chunk)
+                    chunk = []
+            await token_queue.put(chunk)
+            await token_queue.put(None)
+        except Exception as e:
+            await token_queue.put(e)
+
+    async def look_up():
+        try:
+            contexts = WordContexts()
+            last_report = None
+            index = 0
+            while True:
+                chunk = await token_queue.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                last_word = contexts.word_trio[2]
+                finished = chunk is None
+                if finished:
+                    chunk = []
+                    chunk_contexts = [contexts.finish()]
+                else:
+                    chunk_contexts = list(contexts.feed(chunk))
+                reports = await loop.run_in_executor(lookups, score_chunk, config, chunk, chunk_contexts, last_report, index, last_word)
+                if len(reports) > 0:
+                    last_report = reports[-1]
+                    index += len(reports)
+                    await report_queue.put(reports)
+                if finished:
+                    break
+            await report_queue.put(None)
+        except Exception as e:
+            await report_queue.put(e)
+
+    stages = [asyncio.ensure_future(tokenize()), asyncio.ensure_future(look_up())]
+    try:
+        while True:
+            reports = await report_queue.get()
+            if reports is None:
+                break
+            if isinstance(reports, Exception):
+                raise reports
+            for report in reports:
+                yield report
+    finally:
+        for stage in stages:
+            stage.cancel()
+        lookups.shutdown(wait=True)
+        config["resolved"] = {}
+
+
+def split_lines(lines):
+    """ Yields [lines] (eg: from a file opened with open()) broken wherever str.splitlines() would break them, as
+    codecs.open() files and Checker.check() of a string are. Those also end lines at form feeds, \u2028 etc."""
+    for line in lines:
+        for piece in line.splitlines(True):
+            yield piece
+
+
+async def read_lines(in_file, size_hint=65536):
+    """ Yields the lines of a regular (blocking) file object, reading them a block at a time in a thread."""
+    loop = asyncio.get_running_loop()
+    while True:
+        lines = await loop.run_in_executor(None, in_file.readlines, size_hint)
+        if len(lines) == 0:
+            break
+        for line in split_lines(lines):
+            yield line
+
+
+async def stream_text(config, checker, in_file, writer):
+    """ -stream: checks [in_file] through the asyncio pipeline, rendering Reports as they come."""
+    async for report in checker.check_async(read_lines(in_file)):
+        writer.show(report)
+
+
+def process_text(config, checker):
+    """ Processes the input text. ("-" reads it from stdin.) """
+    if config["in"] == "-" or os.path.isfile(config["in"]):
+        writer = ReportWriter(config)
+        writer.start()
+        if config["stream"]:
+            # Not codecs.open(): its readlines() ignores the size hint and would read the whole file at once.
+            in_file = sys.stdin if config["in"] == "-" else io.open(config["in"], 'r', encoding='utf-8', newline='')
+            asyncio.run(stream_text(config, checker, in_file, writer))
+            if in_file is not sys.stdin:
+                in_file.close()
+            reports = []
+        elif config["in"] == "-":
+            reports = checker.check(split_lines(sys.stdin))
+        elif config["incremental"]:
+            reports = checker.recheck_file(config["in"])
         else:
-            output = csv.writer(sys.stdout, dialect='excel')
-            output.writerow([config["word_count"], report["word"]+fragment, report["score"], report["frequency_before"], report["frequency_after"]])
+            reports = checker.check_file(config["in"])
+        for report in reports:
+            writer.show(report)
+        writer.end()
+        if config["counters"] is not None:
+            if config["stats"] == "json":
+                sys.stderr.write(json.dumps(config["counters"].as_dict(), sort_keys=True) + "\n")
+            else:
+                sys.stderr.write(config["counters"].summary())
 
-    else:    # Dump the output to its chosen locaiton.
-        if config["out"] is not None:
-            out_file = codecs.open(config["out"], 'a', 'utf-8')
-            out_file.write(out_string)
-            out_file.close()
+    else:
+        print("Error: the input file [%s] was not found." % config["in"])
+
+
+def find_inputs(spec):
+    """ Lists the files to check for batch mode. [spec] is a folder (every file in it), a manifest file (one file
+    name per line) or a glob pattern."""
+    if os.path.isdir(spec):
+        return sorted(os.path.join(spec, file_name) for file_name in os.listdir(spec) if os.path.isfile(os.path.join(spec, file_name)))
+    if os.path.isfile(spec):
+        in_file = codecs.open(spec, 'r', 'utf-8')
+        file_names = [line.strip("\n\r") for line in in_file if line.strip("\n\r\t ") != "" and line[0] != "#"]
+        in_file.close()
+        return file_names
+    return sorted(glob.glob(spec))
+
+
+def output_name(config, file_name, base):
+    """ Where batch mode saves the report for [file_name]: the same relative path under -outdir, with the right extension."""
+    extensions = {"text": ".txt", "csv": ".csv", "tsv": ".tsv", "html": ".html", "full_html": ".html"}
+    relative = os.path.relpath(os.path.abspath(file_name), base)
+    return os.path.join(config["outdir"], os.path.splitext(relative)[0] + extensions[config["type"]])
+
+
+batch_checker = None    # The Checker batch workers use. Set before the pool starts so forked workers share it.
+
+
+def start_batch_worker(options):
+    """ Sets up a batch worker. Forked workers already share the main process's Checker, others load their own."""
+    global batch_checker
+    if batch_checker is None:
+        batch_checker = Checker(**options)
+
+
+def check_document(job):
+    """ Checks one document for batch mode. Returns (file name, word count or list of report dicts, error)."""
+    file_name, out_name = job
+    if not os.path.isfile(file_name):
+        return (file_name, None, "file not found")
+    try:
+        if out_name is None:
+            return (file_name, [report._asdict() for report in batch_checker.check_file(file_name)], None)
+        out_path = os.path.dirname(out_name)
+        if out_path != "":
+            os.makedirs(out_path, exist_ok=True)    # Another worker may be making it too.
+        doc_config = dict(batch_checker.config)
+        doc_config.update({"in": file_name, "out": out_name, "counters": None})
+        writer = ReportWriter(doc_config)
+        writer.start()
+        count = 0
+        for report in batch_checker.check_file(file_name):
+            writer.show(report)
+            count += 1
+        writer.end()
+        return (file_name, count, None)
+    except Exception as e:
+        return (file_name, None, "%s: %s" % (type(e).__name__, e))
+
+
+def process_batch(config, checker):
+    """ Checks every file named by -inputs across a pool of -workers processes, saving a report per file
+    under -outdir or one JSON line per file to -jsonl."""
+    global batch_checker
+    file_names = find_inputs(config["inputs"])
+    if len(file_names) == 0:
+        print("Error: No input files found for [%s]." % config["inputs"])
+        return False
+    if config["outdir"] is None and config["jsonl"] is None:
+        print("Error: Batch mode needs somewhere to put the reports. Use -outdir or -jsonl.")
+        return False
+
+    jobs = []
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(file_name)) for file_name in file_names])
+    inputs = set(os.path.realpath(file_name) for file_name in file_names)
+    outputs = {}
+    for file_name in file_names:
+        if config["outdir"] is not None:
+            out_name = output_name(config, file_name, base)
+            # Writing a report truncates its file, so it mustn't be an input or another input's report.
+            if os.path.realpath(out_name) in inputs:
+                print("Error: The report for [%s] would overwrite the input file [%s]. Use another -outdir." % (file_name, out_name))
+                return False
+            if os.path.realpath(out_name) in outputs:
+                print("Error: [%s] and [%s] would both be reported in [%s]. Rename one of them." % (outputs[os.path.realpath(out_name)], file_name, out_name))
+                return False
+            outputs[os.path.realpath(out_name)] = file_name
+            jobs.append((file_name, out_name))
         else:
-            sys.stdout.write(out_string)
+            jobs.append((file_name, None))
 
+    jsonl_file = None
+    if config["jsonl"] == "-":
+        jsonl_file = sys.stdout
+    elif config["jsonl"] is not None:
+        jsonl_file = codecs.open(config["jsonl"], 'w', 'utf-8')
 
-def process_text(config):
-    """ Processes the input text. """
-    if os.path.isfile(config["in"]):
-        if os.path.isfile(config["dict"]+config["custom_dict_name"]):
-            in_file = codecs.open(config["in"], 'r', 'utf-8')
-            word_trio = ["", "", ""]
-            config["word_count"] = 0
-            last_report = {}
-            for data_in in in_file:
-                word_list = data_in.split(" ")
-                for word in word_list:
-                    if len(strip_word(word)) > 0:
-                        word = word.strip(" ")
-                        if word not in ["", "\t", "\n", "\r", " "]:
-                            word_trio.append(word)
-                            word_trio.pop(0)
-                            if word_trio[1] != "":
-                                report = report_familiarity(config, word_trio, last_report)
-                                if "fragment" in last_report:
-                                    show_report(config, report, last_report["fragment"])
-                                else:
-                                    show_report(config, report, "")
-                                config["word_count"] += 1
-                                last_report = report
-                    else:
-                        if word not in ["", "\t", "\n", "\r", " "]:   # There's a fragment of something (probably punctuation) save for later.
-                            report = {"fragment": word}
-                            last_report = report
-            # Process the last word in the file.
-            word_trio.append("")
-            word_trio.pop(0)
-            report = report_familiarity(config, word_trio)
-            show_report(config, report)
+    batch_checker = checker
+    if config["workers"] > 1:
+        options = dict((key, config[key]) for key in Checker.defaults)
+        options["type"] = config["type"]   # For check_document()'s ReportWriter.
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+        # Unlike multiprocessing.Pool, the executor notices a worker that dies (eg: killed for using too much memory.)
+        pool = ProcessPoolExecutor(config["workers"], mp_context=context, initializer=start_batch_worker, initargs=(options,))
+        results = pool.map(check_document, jobs, chunksize=max(1, min(32, len(jobs) // (config["workers"] * 4))))
+    else:
+        pool = None
+        results = (check_document(job) for job in jobs)
+
+    failed = 0
+    done = 0
+    try:
+        for file_name, result, error in results:
+            done += 1
+            if error is not None:
+                failed += 1
+                sys.stderr.write("Error: Checking [%s] failed (%s).\n" % (file_name, error))
+            elif jsonl_file is not None:
+                jsonl_file.write(json.dumps({"file": file_name, "reports": result}) + "\n")
+            if done % 100 == 0 or done == len(jobs):
+                sys.stderr.write("Checked %i of %i files.\n" % (done, len(jobs)))
+    except BrokenProcessPool:
+        sys.stderr.write("Error: A worker process died. Stopped after checking %i of %i files.\n" % (done, len(jobs)))
+        failed += len(jobs) - done
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if jsonl_file is not None and jsonl_file is not sys.stdout:
+        jsonl_file.close()
+    batch_checker = None
+    if failed > 0:
+        sys.stderr.write("Error: %i of %i files could not be checked.\n" % (failed, len(jobs)))
+        return False
+    return True
+
+
+class CheckHandler(BaseHTTPRequestHandler):
+    """ Answers POST /check with {"texts": [...]} by returning {"reports": [[report, ...], ...]}, one list per text."""
+
+    def do_POST(self):
+        if self.path != "/check":
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(length).decode('utf-8'))["texts"]
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise TypeError("texts must be a list of strings")
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400, "Expected a JSON object with a list of \"texts\" (strings).")
+            return
+        reports = [[report._asdict() for report in self.server.checker.check(text)] for text in texts]
+        body = json.dumps({"reports": reports}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # Don't clutter the console with every request.
+
+
+def run_server(config, checker):
+    """ Keeps the dictionary loaded and checks texts posted to http://127.0.0.1:[port]/check until interrupted."""
+    server = HTTPServer(("127.0.0.1", config["server"]), CheckHandler)
+    server.checker = checker
+    print("Ingram listening on http://127.0.0.1:%i/check (Control-C to stop.)" % config["server"])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
 
+
+def check_remote(url, texts):
+    """ Has the ingram server at [url] check a list of texts. Returns a list of report lists, one per text."""
+    request = Request(url.rstrip("/") + "/check", json.dumps({"texts": texts}).encode('utf-8'), {"Content-Type": "application/json"})
+    response = urlopen(request)
+    reports = json.loads(response.read().decode('utf-8'))["reports"]
+    response.close()
+    return [[Report(**report) for report in text_reports] for text_reports in reports]
+
+
+def process_remote(config):
+    """ Processes the input text using a running ingram server instead of the local dictionary."""
+    if os.path.isfile(config["in"]):
+        in_file = codecs.open(config["in"], 'r', 'utf-8')
+        text = in_file.read()
+        in_file.close()
+        writer = ReportWriter(config)
+        writer.start()
+        for report in check_remote(config["remote"], [text])[0]:
+            writer.show(report)
+        writer.end()
     else:
         print("Error: the input file [%s] was not found." % config["in"])
 
@@ -248,13 +1037,7 @@ def remove_custom(config):
 
 def strip_word(word):
     """Converts a word to lowercase and strips out all non alpha characters."""
-    stripped = ""
-    word = word.lower()
-    for char in word:
-        ascii = ord(char)
-        if ascii >= 97 and ascii <= 122:
-            stripped += char
-    return stripped
+    return strip_letters(word.lower())
 
 
 def load_custom_dict(config):
@@ -285,40 +1068,212 @@ def load_custom_dict(config):
         return False
 
 
+def load_compiled_dict(config):
+    """ Open the compiled dictionary and Bloom filter if there are any. Otherwise lookups fall back to the (cached) text shards."""
+    config["compiled_dict"] = None
+    config["shard_cache"] = None
+    config["filter"] = None
+    if not config["nofilter"]:
+        config["filter"] = open_filter(config["dict"])
+    if not config["nocompiled"]:
+        config["compiled_dict"] = open_compiled(config["dict"])
+    if config["compiled_dict"] is None and config["cachemb"] > 0:
+        config["shard_cache"] = ShardCache(config["cachemb"], config["counters"])
+        if config["counters"] is not None:
+            config["counters"].cache = config["shard_cache"]
+    config["years"] = None
+    if config["startyear"] is not None or config["endyear"] is not None:
+        if config["compiled_dict"] is None or not config["compiled_dict"].decades:
+            raise ValueError("-startyear and -endyear need a dictionary built with -decades and compiled with compiledict.py.")
+        config["years"] = (config["startyear"] if config["startyear"] is not None else 0, config["endyear"] if config["endyear"] is not None else 9999)
+
+
+def load_trigram_dict(config):
+    """ Open the -trigrams dictionary and its Bloom filter, if one was given. It has to be compiled."""
+    config["trigram_dict"] = None
+    config["trigram_filter"] = None
+    if config["trigrams"] is None:
+        return
+    config["trigrams"] = os.path.join(config["trigrams"], "")
+    config["trigram_dict"] = open_compiled(config["trigrams"])
+    if config["trigram_dict"] is None:
+        raise ValueError("No compiled 3-gram dictionary found in [%s]. Compile it with compiledict.py -blocks." % config["trigrams"])
+    if config["years"] is not None and not config["trigram_dict"].decades:
+        raise ValueError("-startyear and -endyear need the -trigrams dictionary built with -decades too.")
+    if not config["nofilter"]:
+        config["trigram_filter"] = open_filter(config["trigrams"])
+
+
+class Checker(object):
+    """Rates the familiarity of text against a dictionary. Load it once and check as many texts as you like.
+
+    Options are the same as the command line's (eg: Checker(dict="dictionary/", maxfreq=20000).)
+    """
+
+    defaults = {"dict": "dictionary/", "maxfreq": 20000, "missinghit": 55, "batch": 0, "cachemb": 64, "nocompiled": False, "nofilter": False, "stats": None, "startyear": None, "endyear": None, "incremental": False, "stream": False, "trigrams": None, "missingtrigram": 55}
+
+    def __init__(self, **options):
+        self.config = dict(self.defaults)
+        self.config.update(options)
+        self.config["custom_dict_name"] = "custom.txt"
+        self.config["resolved"] = {}     # Frequencies looked up ahead of time by batch mode.
+        self.config["counters"] = None
+        if self.config["stats"] is not None:
+            self.config["counters"] = Stats()
+        if not os.path.exists(self.config["dict"]):
+            raise IOError("No dictionary found in path [%s]." % self.config["dict"])
+        load_custom_dict(self.config)
+        load_compiled_dict(self.config)
+        load_trigram_dict(self.config)
+
+    def check(self, text):
+        """Yields a Report for each word in [text], which can be a string or any iterable of lines (eg: an open file)."""
+        if isinstance(text, str):
+            text = text.splitlines(True)
+        tokens = read_tokens(text)
+        if self.config["batch"] > 0:
+            tokens = batch_tokens(self.config, tokens)
+        try:
+            for report in score_tokens(self.config, tokens):
+                yield report
+        finally:
+            self.config["resolved"] = {}
+
+    def check_async(self, lines):
+        """The asyncio version of check(). Yields (asynchronously) a Report for each word in [lines], an async
+        iterable of lines such as an asyncio.StreamReader. Use one at a time per Checker."""
+        return pipeline_reports(self.config, lines)
+
+    def check_file(self, file_name):
+        """Yields a Report for each word in the utf-8 text file [file_name]."""
+        in_file = codecs.open(file_name, 'r', 'utf-8')
+        try:
+            for report in self.check(in_file):
+                yield report
+        finally:
+            in_file.close()
+
+    def recheck_file(self, file_name, sidecar=None):
+        """Like check_file(), but only rates the words near changes since the last recheck_file() of [file_name],
+        reusing the rest. Returns a list of Reports. The previous run is saved in [sidecar]. (Default: [file_name].ingram)"""
+        if sidecar is None:
+            sidecar = file_name + SIDECAR_EXTENSION
+        in_file = codecs.open(file_name, 'r', 'utf-8')
+        try:
+            contexts = list(word_contexts(read_tokens(in_file)))
+        finally:
+            in_file.close()
+        offsets = [offset for context, offset in contexts]
+        contexts = [context for context, offset in contexts]
+        reports = list(rescore_contexts(self.config, contexts, offsets, load_sidecar(self.config, sidecar)))
+        save_sidecar(self.config, sidecar, reports)
+        return reports
+
+    def stats(self):
+        """What the lookups, whitelist and output have been up to. (Only counted when created with stats="text" or "json".)"""
+        if self.config["counters"] is None:
+            return None
+        return self.config["counters"].as_dict()
+
+    def frequency(self, s):
+        """Reports the raw frequency of the two word string [s]. None if the dictionary doesn't cover it."""
+        return find_frequency(self.config, s)
+
+    def trigram_frequency(self, s):
+        """Reports the raw frequency of the three word string [s] in the -trigrams dictionary. None if it doesn't cover it."""
+        if self.config["trigram_dict"] is None:
+            return None
+        return find_trigram_frequency(self.config, s)
+
+    def close(self):
+        if self.config["compiled_dict"] is not None:
+            self.config["compiled_dict"].close()
+            self.config["compiled_dict"] = None
+        if self.config["trigram_dict"] is not None:
+            self.config["trigram_dict"].close()
+            self.config["trigram_dict"] = None
+
+
 def get_config():
     """ Parse the command line arguments. """
     parser = argparse.ArgumentParser(description="A tool for checking spelling and grammar using Google's ngram corpus.")
-    parser.add_argument('-in', help='Text file to process.', required=False, default="", metavar="FILE")
+    parser.add_argument('-in', help='Text file to process. Use "-" to read from stdin.', required=False, default="", metavar="FILE")
+    parser.add_argument('-inputs', help='Batch mode: check many files. A folder (every file in it), a manifest file (one file name per line) or a quoted glob pattern.', required=False, default="", metavar="SPEC")
+    parser.add_argument('-outdir', help='Batch mode: save each report in this folder, named after its input file.', required=False, default=None, metavar="PATH")
+    parser.add_argument('-jsonl', help='Batch mode: write every report to this file ("-" for stdout) as one line of JSON per input file.', required=False, default=None, metavar="FILE")
+    parser.add_argument('-workers', help='Batch mode: number of processes checking files at once. (Default: 1)', required=False, default=1, type=int, metavar="N")
+    parser.add_argument('-stream', help='Read, look up and write in overlapping stages (with asyncio.) Memory use stays the same however long the input is.', action="store_true")
+    parser.add_argument('-incremental', help='Save the reports next to the input file (as FILE.ingram) and next time only re-check the words near what has changed.', action="store_true")
     parser.add_argument('-out', help='Name to save output. Will be overwritten if it exists. If not defined output is echoed to stdout.', required=False, metavar="FILE")
     parser.add_argument('-type', help='[text, csv, tsv, html, full_html] Type of output to produce.', required=False, default="text", metavar="TYPE")
     parser.add_argument('-dict', help="Dictionary to use. (default /dictionary/)", required=False, default="dictionary/", metavar="PATH")
     parser.add_argument('-add', help="Add a word to the custom whitelist.", required=False, default="", metavar="STRING")
     parser.add_argument('-remove', help="Remove a word from the custom whitelist.", required=False, default="", metavar="STRING")
+    parser.add_argument('-server', help="Keep the dictionary loaded and check texts sent to this port on localhost until interrupted.", required=False, default=0, type=int, metavar="PORT")
+    parser.add_argument('-remote', help="Check the input file using an ingram server at this address instead of the local dictionary. (eg: http://127.0.0.1:8750/)", required=False, default="", metavar="URL")
     parser.add_argument('-maxfreq', help="[Advanced] Frequency hits above this will not improve the familiarity score. Higher = more sensitive. (Default: 20,000.)", default=20000, type=int, required=False, metavar="INT")
     parser.add_argument('-missinghit', help="[Advanced] Percentage points removed from a word's score if there's no record of a pairing. Higher = missing matches are more visible. (Default: 55)", default=55, type=int, required=False, metavar="INT")
+    parser.add_argument('-trigrams', help="3-gram dictionary (built with dictprocess.py -trigrams and compiled) to check each word together with both its neighbors as well.", required=False, default=None, metavar="PATH")
+    parser.add_argument('-missingtrigram', help="[Advanced] Percentage points removed from a word's score if it's familiar with each neighbor but there's no record of the three together. Needs -trigrams. (Default: 55)", default=55, type=int, required=False, metavar="INT")
+    parser.add_argument('-batch', help="[Advanced] Read this many words at a time and look up all their word pairs together, reading each dictionary file once per batch. 0 looks words up one at a time. (Default: 0)", default=0, type=int, required=False, metavar="INT")
+    parser.add_argument('-stats', help="[Advanced] Count and time lookups, whitelist checks and output and print a summary to stderr when done. 'json' prints it as JSON.", nargs="?", const="text", default=None, choices=["text", "json"])
+    parser.add_argument('-profile', help="[Advanced] Run under cProfile and save the profile to FILE ('-' prints the top functions to stderr.)", required=False, default=None, metavar="FILE")
+    parser.add_argument('-cachemb', help="[Advanced] Memory (in MB) used to keep recently read dictionary files in memory when there's no compiled dictionary. 0 disables it. (Default: 64)", default=64, type=int, required=False, metavar="INT")
+    parser.add_argument('-nocompiled', help="[Advanced] Ignore the compiled dictionary and read the text files directly.", action="store_true")
+    parser.add_argument('-nofilter', help="[Advanced] Ignore the dictionary's Bloom filter and look up every word pair.", action="store_true")
+    parser.add_argument('-startyear', help="[Advanced] Only count uses from this year on, rounded down to the decade. Needs a dictionary built with -decades. (Default: all)", default=None, type=int, required=False, metavar="YEAR")
+    parser.add_argument('-endyear', help="[Advanced] Only count uses up to this year, rounded up to the decade. Needs a dictionary built with -decades. (Default: all)", default=None, type=int, required=False, metavar="YEAR")
     config = vars(parser.parse_args())
 
-    # Add some useful things to the config.
-    config["custom_dict_name"] = "custom.txt"
-
     # Some super basic verification.
     if config["type"] not in ["text", "html", "csv", "full_html", "tsv"]:
         print("Error: Output type [%s] not recognized." % config["type"])
         exit(1)
+    if config["incremental"] and config["in"] == "-":
+        print("Error: -incremental needs an input file to keep its reports next to.")
+        exit(1)
+    if config["incremental"] and config["stream"]:
+        print("Error: -incremental and -stream can't be used together.")
+        exit(1)
 
     return config
 
 
-# Begin Main
-config = get_config()
-if not load_custom_dict(config):
-    config = None
-if config is not None:
+def main():
+    config = get_config()
+    if config["remote"] != "":
+        if config["in"] != "":
+            process_remote(config)
+        return
+    try:
+        checker = Checker(**config)
+    except IOError:
+        print("Error: No dictionary found in path [%s]." % config["dict"])
+        return
+    except ValueError as error:
+        print("Error: %s" % error)
+        exit(1)
+    config = checker.config
     if config["add"] != "":
         add_custom(config)
     if config["remove"] != "":
         remove_custom(config)
-    if config["in"] != "":
-        start_report(config)
-        process_text(config)
-        end_report(config)
+    if config["in"] != "" and config["profile"] is not None:
+        profiler = cProfile.Profile()
+        profiler.runcall(process_text, config, checker)
+        if config["profile"] == "-":
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+        else:
+            profiler.dump_stats(config["profile"])
+    elif config["in"] != "":
+        process_text(config, checker)
+    if config["inputs"] != "":
+        if not process_batch(config, checker):
+            exit(1)
+    if config["server"] != 0:
+        run_server(config, checker)
+    checker.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Compiles a small made-up dictionary in every format and checks each one finds what the text shards do. Runs offline."""
+
+import argparse
+import codecs
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import compiledict
+import ingram
+
+
+def make_dictionary(dictpath, rng, entries):
+    """ Writes -decades text shards of about [entries] random ngrams (some single words, some repeated), unsorted as
+    dictprocess.py leaves them. Returns the ngrams written."""
+    vocabulary = set()
+    while len(vocabulary) < max(entries // 4, 10):
+        vocabulary.add("".join(rng.choice("etaoinshrdlucmfwypvbgkjqxz") for i in range(rng.randint(1, 7))))
+    vocabulary = sorted(vocabulary)
+    shards = {}
+    for i in range(entries):
+        first = rng.choice(vocabulary)
+        ngram = first if rng.random() < 0.05 else first + " " + rng.choice(vocabulary)
+        decades = dict((decade, rng.randint(1, 500)) for decade in rng.sample(range(180, 202), rng.randint(1, 6)))
+        shards.setdefault(compiledict.shard_name(ngram), []).append("%s\t%i\t%s\n" % (ngram, sum(decades.values()), compiledict.format_decades(decades)))
+    ngrams = []
+    for name, lines in shards.items():
+        if not os.path.isdir(dictpath + name[0]):
+            os.makedirs(dictpath + name[0])
+        out_file = codecs.open(dictpath + name[0] + "/" + name + ".txt", 'w', 'utf-8')
+        out_file.write("".join(lines))
+        out_file.close()
+        ngrams.extend(line.split("\t")[0] for line in lines)
+    return sorted(set(ngrams))
+
+
+def text_frequency(dictpath, ngram, years):
+    """ The reference answer: a linear scan of the text shard, as ingram does without a compiled dictionary. The
+    first entry found wins. [years] are added up by decade from the third column."""
+    file_name = dictpath + ngram[0] + "/" + compiledict.shard_name(ngram) + ".txt"
+    if not os.path.isfile(file_name):
+        return None if os.path.isdir(dictpath + ngram[0]) else 0
+    in_file = codecs.open(file_name, 'r', 'utf-8')
+    try:
+        for data_in in in_file:
+            data_list = data_in.rstrip("\n").split("\t")
+            if data_list[0] == ngram:
+                if years is None:
+                    return int(data_list[1])
+                return sum(count for decade, count in compiledict.parse_decades(data_list[2]).items() if years[0] // 10 <= decade <= years[1] // 10)
+    finally:
+        in_file.close()
+    return 0
+
+
+def check_format(label, dictpath, ngrams, misses, compile):
+    """ Compiles a copy of the dictionary with [compile] and compares its lookups with the text shards'. Returns
+    the number of mismatches (and prints the first few.)"""
+    copy = dictpath.rstrip("/") + "_" + label + "/"
+    shutil.copytree(dictpath, copy)
+    compile(copy)
+    compiled = compiledict.open_compiled(copy)
+    year_ranges = [None] + ([(1850, 1899), (1900, 1999), (1995, 2001)] if compiled.decades else [])
+    failed = 0
+    for years in year_ranges:
+        for ngram in ngrams + misses:
+            expected = text_frequency(dictpath, ngram, years)
+            found = compiled.frequency(ngram, years)
+            if found != expected:
+                if failed < 5:
+                    print("  %s: [%s] %s found %r, the text shards have %r." % (label, ngram, years or "", found, expected))
+                failed += 1
+    compiled.close()
+    print("%s: %i lookups, %i wrong." % (label, len(year_ranges) * (len(ngrams) + len(misses)), failed))
+    return failed
+
+
+def check_filter(dictpath, ngrams, misses):
+    """ Builds the Bloom filter and checks that it lets every ngram in the dictionary through. Returns the number
+    of ngrams it wrongly turns away."""
+    compiledict.build_filter(dictpath, 0.01)
+    bloom = compiledict.open_filter(dictpath)
+    failed = sum(1 for ngram in ngrams if not bloom.might_contain(ngram))
+    passed = sum(1 for ngram in misses if bloom.might_contain(ngram))
+    os.remove(dictpath + compiledict.FILTER_NAME)
+    print("filter: %i of %i entries turned away, %i of %i misses let through." % (failed, len(ngrams), passed, len(misses)))
+    return failed
+
+
+def run_checks(config):
+    """ Makes the dictionary in a scratch folder and checks every format against it. Returns the number of failures."""
+    rng = random.Random(config["seed"])
+    workpath = tempfile.mkdtemp(prefix="ingram_roundtrip_") + "/"
+    dictpath = workpath + "dictionary/"
+    try:
+        ngrams = make_dictionary(dictpath, rng, config["entries"])
+        # Misses land in real shards, shards that don't exist and letters that don't exist.
+        misses = [ngram + "qq" for ngram in rng.sample(ngrams, min(len(ngrams), 500))] + ["zzz zzz", "aaa", "q"]
+        failed = 0
+        formats = [
+            ("compiled", compiledict.compile_dictionary),
+            ("interned", lambda path: compiledict.compile_dictionary(path, interned=True)),
+            ("blocks", lambda path: compiledict.compile_dictionary(path, blocks=True)),
+            ("blocks_spilled", lambda path: compiledict.compile_blocks(path, run_size=max(config["entries"] // 50, 1))),
+        ]
+        for label, compile in formats:
+            failed += check_format(label, dictpath, ngrams, misses, compile)
+        failed += check_filter(dictpath, ngrams, misses)
+        # And end to end, the way ingram looks word pairs up with the filter in front of a compiled dictionary.
+        compiledict.compile_dictionary(dictpath)
+        compiledict.build_filter(dictpath, 0.01)
+        checker = ingram.Checker(dict=dictpath)
+        pairs = [ngram for ngram in ngrams + misses if " " in ngram]
+        wrong = sum(1 for ngram in pairs if checker.frequency(ngram) != text_frequency(dictpath, ngram, None))
+        checker.close()
+        print("checker: %i lookups, %i wrong." % (len(pairs), wrong))
+        failed += wrong
+    finally:
+        shutil.rmtree(workpath)
+    return failed
+
+
+def get_config():
+    """ Parse the command line arguments. """
+    parser = argparse.ArgumentParser(description="Check that every compiled dictionary format finds the same frequencies as the text shards.")
+    parser.add_argument('-seed', help="Random seed for the made-up dictionary. (Default: 1)", default=1, type=int, metavar="INT")
+    parser.add_argument('-entries', help="Entries in the made-up dictionary. (Default: 5000)", default=5000, type=int, metavar="INT")
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+    if run_checks(get_config()) > 0:
+        print("Error: Some lookups didn't match the text shards.")
+        sys.exit(1)
+    print("All formats match the text shards.")